@@ -1,8 +1,10 @@
 #!./venv/bin/python
 
-import sys, os, json, gzip, subprocess, multiprocessing as mp
+import sys, os, gzip, subprocess, multiprocessing as mp
 from pathlib import Path
 
+from shards import load_articles
+
 # make sure you do this for each year
 # 1. take processing files
 # 2. find ids
@@ -21,17 +23,18 @@ def process(args):
     for path, _, files in os.walk(path):
         for file in files:
             src_parse_path = Path(path) / file
-            with open(src_parse_path, "rb") as f:
-                id = json.load(f)["id"]
-
-            src_og_path = Path(og_src) / website / f"{id}.gz"
-            with gzip.open(src_og_path, "rb") as f:
-                data = f.read()
-
-            save_path = Path(archive_dest) / website / year / f"{id}.json"
-            with open(save_path, "wb") as f:
-                f.write(data)
-            file_count += 1
+            # a parsed json or a shard with a month of them
+            for article in load_articles(str(src_parse_path)):
+                id = article["id"]
+
+                src_og_path = Path(og_src) / website / f"{id}.gz"
+                with gzip.open(src_og_path, "rb") as f:
+                    data = f.read()
+
+                save_path = Path(archive_dest) / website / year / f"{id}.json"
+                with open(save_path, "wb") as f:
+                    f.write(data)
+                file_count += 1
     print(f"compressing {website} {year} {file_count}")
     compress_path = Path(archive_dest) / website / year
     subprocess.run(["tar", "-cJf", f"{compress_path}.tar.xz", compress_path])
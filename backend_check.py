@@ -0,0 +1,94 @@
+#!./venv/bin/python
+# run every site parser through each html backend on a sample of raw pages and
+# report where url/date/title/text differ from the html.parser reference,
+# also checks that the raw html date probe agrees with the parsed date
+import multiprocessing as mp, sys, os, gzip, json, random, time
+
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from tqdm import tqdm
+
+from backends import BACKENDS, HTML_PARSER, make_soup
+from parser import DATE_FORMAT, PARSER_MAP, Parser
+
+FIELDS = ("url", "date", "title", "text")
+
+
+def extract(parser: Parser, content: str, backend: str) -> Tuple[Dict[str, str], float]:
+    start = time.perf_counter()
+    ret = {}
+    try:
+        html = make_soup(content, backend)
+    except Exception as e:
+        return {field: f"error: {e}" for field in FIELDS}, time.perf_counter() - start
+    # same call order as parser.process, text() strips tags from the tree
+    for field in FIELDS:
+        try:
+            ret[field] = getattr(parser, field)(html)
+        except Exception as e:
+            ret[field] = f"error: {e}"
+    return ret, time.perf_counter() - start
+
+
+def check_file(args: Tuple[str, Path, List[str]]):
+    site, path, backends = args
+    with gzip.open(path, "rt", encoding="UTF-8") as f:
+        content = json.load(f)["content"]
+    parser_type = type(PARSER_MAP[site])
+    results = {b: extract(parser_type(backend=b), content, b) for b in backends}
+    return site, path, results, PARSER_MAP[site].probe_date(content)
+
+
+def sample_files(src: Path, sample_size: int) -> List[Tuple[str, Path]]:
+    rnd = random.Random(0)
+    ret = []
+    for site in sorted(os.listdir(src)):
+        if site not in PARSER_MAP or not (src / site).is_dir(): continue
+        files = sorted(f for f in os.listdir(src / site) if f.endswith(".gz"))
+        ret.extend((site, src / site / f) for f in rnd.sample(files, min(sample_size, len(files))))
+    return ret
+
+
+if __name__ == "__main__":
+    _, src_root, sample_size, *backends = sys.argv
+    backends = [HTML_PARSER] + [b for b in (backends or BACKENDS) if b != HTML_PARSER]
+    files = sample_files(Path(src_root), int(sample_size))
+
+    timings = defaultdict(float)
+    pages = defaultdict(int)
+    mismatches = defaultdict(int)
+    examples = defaultdict(list)
+    with mp.Pool(mp.cpu_count()) as p:
+        for site, path, results, probed in tqdm(p.imap_unordered(check_file, [(s, f, backends) for s, f in files])):
+            pages[site] += 1
+            ref, _ = results[HTML_PARSER]
+            if probed is not None:
+                mismatch = ref["date"].startswith("error: ") or datetime.strptime(ref["date"], DATE_FORMAT) != probed
+                mismatches[site, "probe"] += mismatch
+                if mismatch and len(examples[site, "probe"]) < 3:
+                    examples[site, "probe"].append(f"{path} date: {ref['date']!r:.80} != {probed:{DATE_FORMAT}}")
+            for backend, (res, took) in results.items():
+                timings[site, backend] += took
+                for field in FIELDS:
+                    if backend == HTML_PARSER or res[field] == ref[field]: continue
+                    mismatches[site, backend, field] += 1
+                    if len(examples[site, backend]) < 3:
+                        examples[site, backend].append(f"{path} {field}: {ref[field]!r:.80} != {res[field]!r:.80}")
+
+    for site in sorted(pages):
+        print(f"{site} ({pages[site]} pages)")
+        ref_took = timings[site, HTML_PARSER]
+        for backend in backends:
+            counts = ", ".join(f"{f}={mismatches[site, backend, f]}" for f in FIELDS)
+            speedup = ref_took / max(timings[site, backend], 1e-9)
+            print(f"  {backend:<12} {pages[site] / max(timings[site, backend], 1e-9):8.1f} pages/s x{speedup:.2f} mismatches: {counts}")
+            for example in examples[site, backend]:
+                print(f"    {example}")
+        print(f"  date probe mismatches: {mismatches[site, 'probe']}")
+        for example in examples[site, "probe"]:
+            print(f"    {example}")
+
+    sys.exit(1 if any(mismatches.values()) else 0)
@@ -0,0 +1,121 @@
+# html backends for parser.py
+#
+# html.parser -> BeautifulSoup on top of python's html.parser (slow, reference)
+# lxml        -> BeautifulSoup on top of lxml
+# lxml-native -> plain lxml tree wrapped in LxmlTag, which mimics the small part of
+#                the BeautifulSoup api used by the parsers (no soup layer at all)
+from typing import Callable, Dict, List, Optional, Union
+
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup
+
+HTML_PARSER = "html.parser"
+LXML = "lxml"
+LXML_NATIVE = "lxml-native"
+BACKENDS = (HTML_PARSER, LXML, LXML_NATIVE)
+
+# same as bs4 HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+MULTI_VALUED_ATTRS = {"class", "rel", "rev", "accept-charset", "headers", "accesskey", "dropzone"}
+# bs4 does not return strings of these tags from get_text of a parent tag
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+Matcher = Union[None, bool, str, Callable[[Optional[str]], bool]]
+
+
+def make_soup(content: str, backend: str):
+    if backend == HTML_PARSER or backend == LXML:
+        return BeautifulSoup(content, backend)
+    if backend == LXML_NATIVE:
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        return LxmlTag(lxml.html.document_fromstring(content.encode("utf-8"), parser=parser))
+    raise ValueError(f"unknown backend {backend}")
+
+
+def _matches(value, against: Matcher) -> bool:
+    if isinstance(value, list):
+        return any(_matches(v, against) for v in value) or _matches(" ".join(value), against)
+    if against is True:
+        return value is not None
+    if callable(against):
+        return against(value)
+    return value == against
+
+
+class LxmlTag:
+    __slots__ = ("el",)
+
+    def __init__(self, el) -> None:
+        self.el = el
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        count = 1 if self.el.text else 0
+        for child in self.el:
+            count += 2 if child.tail else 1
+        return count
+
+    def __call__(self, *args, **kwargs) -> List["LxmlTag"]:
+        return self.find_all(*args, **kwargs)
+
+    def get(self, key: str, default=None):
+        value = self.el.get(key)
+        if value is None:
+            return default
+        return value.split() if key in MULTI_VALUED_ATTRS else value
+
+    def _match_attrs(self, attrs: Dict[str, Matcher]) -> bool:
+        return all(_matches(self.get(key), against) for key, against in attrs.items())
+
+    def find_all(self, name: Optional[str] = None, attrs=None) -> List["LxmlTag"]:
+        if attrs is not None and not isinstance(attrs, dict):
+            attrs = {"class": attrs}
+        ret = []
+        for el in (self.el.iterdescendants(name) if name else self.el.iterdescendants()):
+            if not isinstance(el.tag, str):
+                continue
+            tag = LxmlTag(el)
+            if not attrs or tag._match_attrs(attrs):
+                ret.append(tag)
+        return ret
+
+    def find(self, name: Optional[str] = None, attrs=None) -> Optional["LxmlTag"]:
+        if attrs is not None and not isinstance(attrs, dict):
+            attrs = {"class": attrs}
+        for el in (self.el.iterdescendants(name) if name else self.el.iterdescendants()):
+            if not isinstance(el.tag, str):
+                continue
+            tag = LxmlTag(el)
+            if not attrs or tag._match_attrs(attrs):
+                return tag
+        return None
+
+    def extract(self) -> "LxmlTag":
+        # bs4 keeps the text around an extracted tag as separate strings, so put an
+        # empty comment in its place instead of letting lxml glue the tail to the previous text
+        parent = self.el.getparent()
+        if parent is not None:
+            placeholder = etree.Comment("")
+            placeholder.tail, self.el.tail = self.el.tail, None
+            parent.replace(self.el, placeholder)
+        return self
+
+    def _strings(self, el, root: bool):
+        if isinstance(el.tag, str) and (root or el.tag not in NON_TEXT_TAGS):
+            if el.text:
+                yield el.text
+            for child in el:
+                yield from self._strings(child, False)
+        if not root and el.tail:
+            yield el.tail
+
+    def get_text(self, separator: str = "", strip: bool = False) -> str:
+        strings = self._strings(self.el, True)
+        if strip:
+            strings = (s.strip() for s in strings)
+            strings = (s for s in strings if s)
+        return separator.join(strings)
+
+    getText = get_text
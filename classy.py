@@ -1,43 +1,89 @@
 #!./venv/bin/python
 
 # classify engl words from given word list
-import sqlite3, time, sys, pickle, multiprocessing as mp
-from typing import List, Optional
+import sqlite3, time, sys, re, functools, multiprocessing as mp
+from typing import Iterable, List
 
+import numpy as np
 
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk import download
+# nltk data and the model load on first use, see resources.py
+from resources import lemmatizer, model, model_sha1, stopwords
 
-from sklearn.pipeline import Pipeline
-
-download("wordnet", quiet=True)
-download("stopwords", quiet=True)
-AEIOUY = set("aeiouy")
+AEIOUY_RE = re.compile("[aeiouy]")
+TRIPLE_LETTER_RE = re.compile(r"(.)\1\1", re.DOTALL)
 VOWELS = set("aeiou")
 CACHE_DB = "cache.db"
+PREFIXES = ["al-"]
+SUFFIXES = ["hr", "com", "eu"]
+# words per model.predict call
+MODEL_BATCH = 4096
+CACHE_TABLES = ["""
+    CREATE TABLE IF NOT EXISTS hml_cache (
+        word TEXT UNIQUE,
+        found BOOL
+    );
+""", """
+    CREATE TABLE IF NOT EXISTS manual_class_cache (
+        word TEXT UNIQUE,
+        is_engl BOOL
+    );
+""", """
+    CREATE TABLE IF NOT EXISTS manual_lemma_cache (
+        word TEXT UNIQUE,
+        lemma TEXT UNIQUE
+    );
+""", """
+    CREATE TABLE IF NOT EXISTS wordnet_lemma_cache (
+        word TEXT PRIMARY KEY,
+        lemma TEXT
+    );
+""", """
+    CREATE TABLE IF NOT EXISTS model_prediction_cache (
+        word TEXT,
+        model TEXT,
+        is_engl BOOL,
+        PRIMARY KEY (word, model)
+    );
+"""]
+
+
+class WordTable:
+    # one numpy array per column, a stage keeps rows by indexing every column with one mask
+    # wn_lemma is filled in on first use, rows dropped before that are never lemmatized
+    COLUMNS = ("word", "freq", "_wn_lemma", "keep", "manual_lemma")
+
+    def __init__(self, word: np.ndarray, freq: np.ndarray, _wn_lemma: np.ndarray = None,
+                 keep: np.ndarray = None, manual_lemma: np.ndarray = None) -> None:
+        self.word = word
+        self.freq = freq
+        self._wn_lemma = _wn_lemma
+        self.keep = np.zeros(len(word), dtype=bool) if keep is None else keep
+        self.manual_lemma = np.full(len(word), None, dtype=object) if manual_lemma is None else manual_lemma
 
-with open(f"NGRAM_SVC.pkl", "rb") as f:
-    model: Pipeline = pickle.load(f)
+    @property
+    def wn_lemma(self) -> np.ndarray:
+        if self._wn_lemma is None: self._wn_lemma = lemmatize(self.word)
+        return self._wn_lemma
 
+    def __len__(self) -> int:
+        return len(self.word)
 
-class Word:
-    wordnet_lemmatizer = WordNetLemmatizer()
-    def __init__(self, word: str, freq: int) -> None:
-        self.word = word
-        self.freq = freq
-        self.wn_lemma = self.wordnet_lemmatizer.lemmatize(word)
-        self.keep = False
-        self.manual_lemma = None
+    def __getitem__(self, mask: np.ndarray) -> "WordTable":
+        columns = {column: getattr(self, column) for column in self.COLUMNS}
+        return WordTable(**{column: None if values is None else values[mask] for column, values in columns.items()})
 
-    def lemma(self) -> str:
-        return self.manual_lemma if self.manual_lemma else self.wn_lemma
+    def mask(self, predicate, column: str = "word") -> np.ndarray:
+        # rules that are not numpy ops, one pass over the column
+        return np.fromiter(map(predicate, getattr(self, column)), dtype=bool, count=len(self))
+
+    def lemma(self) -> np.ndarray:
+        return np.array([m if m else w for m, w in zip(self.manual_lemma, self.wn_lemma)], dtype=object)
 
 def show_progress(func):
     def inner(*args, **kwargs):
         start = time.time()
         input_size = 0
-        if len(args) > 0 and isinstance(args[0], list):
+        if len(args) > 0 and isinstance(args[0], WordTable):
             input_size = len(args[0])
         res = func(*args, **kwargs)
 
@@ -50,6 +96,39 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
+@functools.lru_cache(maxsize=None)
+def cache_db() -> sqlite3.Connection:
+    # one connection for every cache, candidates is where the words to look up are put
+    conn = sqlite3.connect(CACHE_DB)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    for table in CACHE_TABLES: conn.execute(table)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (word TEXT PRIMARY KEY);")
+    return conn
+
+def lookup(select: str, words: Iterable[str], where: str = "1", params: tuple = ()) -> List[tuple]:
+    # only the cached rows of the given words, one join on the cache's word index
+    conn = cache_db()
+    with conn:
+        conn.execute("DELETE FROM candidates;")
+        conn.executemany("INSERT OR IGNORE INTO candidates VALUES (?);", ((word,) for word in words))
+    return conn.execute(f"{select} JOIN candidates USING (word) WHERE {where};", params).fetchall()
+
+def lemmatize(words: np.ndarray, verbose: bool = True) -> np.ndarray:
+    # each distinct word once, from the lemma cache or wordnet, new lemmas go to the cache
+    start = time.time()
+    distinct = set(words.tolist())
+    cache = dict(lookup("SELECT word, lemma FROM wordnet_lemma_cache", distinct))
+    todo = sorted(distinct - cache.keys())
+    if todo:
+        wordnet = lemmatizer()
+        lemmas = [(word, wordnet.lemmatize(word)) for word in todo]
+        conn = cache_db()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO wordnet_lemma_cache VALUES (?, ?);", lemmas)
+        cache.update(lemmas)
+    if verbose: print(f"lemmatized {len(todo)}/{len(distinct)} words not in wordnet lemma cache in {time.time() - start:.3f}s")
+    return np.array([cache[w] for w in words], dtype=object)
+
 def process(word_list_path: str):
     words = load_words(word_list_path)
     words = remove_short_words(words)
@@ -57,8 +136,8 @@ def process(word_list_path: str):
     words = remove_words_in_hml(words)
     words = remove_triple_letter_words(words)
     words = remove_words_without_aeiouy(words)
-    words = remove_words_with_prefix(words, ["al-"])
-    words = remove_words_with_suffix(words, ["hr", "com", "eu"])
+    words = remove_words_with_prefix(words, PREFIXES)
+    words = remove_words_with_suffix(words, SUFFIXES)
     words = remove_words_with_double_vowel_prefix(words)
     words = remove_engl_stopwords(words)
     words = remove_using_manual_dataset(words)
@@ -67,71 +146,68 @@ def process(word_list_path: str):
     save(words, "engl_word_list.csv")
 
 @show_progress
-def load_words(path: str) -> List[Word]:
-    words = []
+def load_words(path: str) -> WordTable:
     with open(path, "r") as f:
-        for i, line in enumerate(f.readlines()):
-            if i == 0 or not line: continue
-            word, freq = line.strip().split(",")
-            words.append(Word(word, int(freq)))
-    return words
+        rows = [line.split(",") for line in f.read().splitlines()[1:] if line]
+    word = np.array([w for w, _ in rows], dtype=object)
+    freq = np.fromiter((int(f) for _, f in rows), dtype=np.int64, count=len(rows))
+    return WordTable(word, freq)
 
 @show_progress
-def remove_short_words(words: List[Word]) -> List[Word]:
-    return [word for word in words if len(word.word) > 2]
+def remove_short_words(words: WordTable) -> WordTable:
+    return words[np.fromiter(map(len, words.word), dtype=np.int64, count=len(words)) > 2]
 
 @show_progress
-def remove_infrequent_words(words: List[Word]) -> List[Word]:
-    return [word for word in words if word.freq > 2]
+def remove_infrequent_words(words: WordTable) -> WordTable:
+    return words[words.freq > 2]
 
 @show_progress
-def remove_triple_letter_words(words: List[Word]) -> List[Word]:
-    return [word for word in words if not has_triple_letter(word.word)]
+def remove_triple_letter_words(words: WordTable) -> WordTable:
+    return words[~words.mask(has_triple_letter)]
 
 def has_triple_letter(word: str) -> bool:
-    for i in range(len(word) - 2):
-        if word[i] == word[i + 1] == word[i + 2]:
-            return True
-    return False
+    return TRIPLE_LETTER_RE.search(word) is not None
 
 @show_progress
-def remove_words_without_aeiouy(words: List[Word]) -> List[Word]:
-    return [word for word in words if len(AEIOUY - set(word.word)) != 6]
+def remove_words_without_aeiouy(words: WordTable) -> WordTable:
+    return words[words.mask(AEIOUY_RE.search)]
 
 @show_progress
-def remove_words_with_prefix(words: List[Word], prefix:List[str]) -> List[Word]:
-    return [word for word in words if not any(word.word.startswith(p) for p in prefix)]
+def remove_words_with_prefix(words: WordTable, prefix: List[str]) -> WordTable:
+    prefix = tuple(prefix)
+    return words[~words.mask(lambda w: w.startswith(prefix))]
 
 @show_progress
-def remove_words_with_suffix(words: List[Word], suffix:List[str]) -> List[Word]:
-    return [word for word in words if not any(word.word.endswith(s) for s in suffix)]
+def remove_words_with_suffix(words: WordTable, suffix: List[str]) -> WordTable:
+    suffix = tuple(suffix)
+    return words[~words.mask(lambda w: w.endswith(suffix))]
 
 @show_progress
-def remove_words_with_double_vowel_prefix(words: List[Word]) -> List[Word]:
-    return [word for word in words if not starts_with_double_vowel(word.word)]
+def remove_words_with_double_vowel_prefix(words: WordTable) -> WordTable:
+    return words[~words.mask(starts_with_double_vowel)]
 
 def starts_with_double_vowel(word: str) -> bool:
     if word in {"aardvark","eerie","eek","eel","llama","ooh","oops","ooze","oozing"}: return False
     return len(word) > 2 and word[0] in VOWELS and word[1] in VOWELS
 
 @show_progress
-def remove_engl_stopwords(words: List[Word]) -> List[Word]:
-    remove = set(stopwords.words())
-    return [word for word in words if word.word not in remove]
+def remove_engl_stopwords(words: WordTable) -> WordTable:
+    remove = stopwords()
+    return words[~words.mask(remove.__contains__)]
 
 @show_progress
-def remove_words_in_hml(words: List[Word]) -> List[Word]:
-    cache = load_hml_cache()
+def remove_words_in_hml(words: WordTable) -> WordTable:
+    cache = load_hml_cache(np.concatenate([words.word, words.wn_lemma]).tolist())
     to_check_hml_words = []
-    ret = []
-    for word in words:
-        hml_found = cache.get(word.word)
-        hml_wn_found = cache.get(word.wn_lemma)
-        if hml_found is None: to_check_hml_words.append(word.word)
+    ret = np.zeros(len(words), dtype=bool)
+    for i, (word, wn_lemma) in enumerate(zip(words.word, words.wn_lemma)):
+        hml_found = cache.get(word)
+        hml_wn_found = cache.get(wn_lemma)
+        if hml_found is None: to_check_hml_words.append(word)
         elif hml_found: continue
-        elif hml_wn_found is None: to_check_hml_words.append(word.wn_lemma)
+        elif hml_wn_found is None: to_check_hml_words.append(wn_lemma)
         elif hml_wn_found: continue
-        else: ret.append(word)
+        else: ret[i] = True
 
     if len(to_check_hml_words) > 0:
         for i, chunk in enumerate(chunks(to_check_hml_words, 49_000)):
@@ -139,101 +215,89 @@ def remove_words_in_hml(words: List[Word]) -> List[Word]:
                 f.write("\n".join(chunk))
         print(f"{len(to_check_hml_words)}/{len(words)} not found in hml cache, add them manully")
         sys.exit(1)
-    return ret
+    return words[ret]
 
-def load_hml_cache():
+def load_hml_cache(words: List[str]):
     start = time.time()
-    hml_cache = {}
-    with sqlite3.connect(CACHE_DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS hml_cache (
-                word TEXT UNIQUE,
-                found BOOL
-            );
-        """)
-        cursor.execute("SELECT word, found FROM hml_cache;")
-        hml_cache = {word: found for word, found in cursor.fetchall()}
+    ret = dict(lookup("SELECT word, found FROM hml_cache", words))
     print(f"hml cache load took {time.time() - start:.3f}s")
-    return hml_cache
-
-@show_progress
-def remove_using_manual_dataset(words: List[Word]) -> List[Word]:
-    cache = load_manual_class_cache()
-    def any_in_cache(word: Word, tpe: int):
-        return any(cache.get(w, -1) == tpe for w in [word.word, word.wn_lemma])
-    ret = []
-    for word in words:
-        # in cache and non engl
-        if any_in_cache(word, 0):
-            continue
-
-        # in cache and is engl
-        if any_in_cache(word, 1):
-            word.keep = True
-
-        ret.append(word)
     return ret
 
-def load_manual_class_cache():
+@show_progress
+def remove_using_manual_dataset(words: WordTable) -> WordTable:
+    cache = load_manual_class_cache(np.concatenate([words.word, words.wn_lemma]).tolist())
+    word_class = np.array([cache.get(w, -1) for w in words.word])
+    lemma_class = np.array([cache.get(w, -1) for w in words.wn_lemma])
+    # in cache and is engl
+    words.keep |= (word_class == 1) | (lemma_class == 1)
+    # in cache and non engl
+    return words[(word_class != 0) & (lemma_class != 0)]
+
+def load_manual_class_cache(words: List[str]):
     start = time.time()
-    ret = {}
-    with sqlite3.connect(CACHE_DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS manual_class_cache (
-                word TEXT UNIQUE,
-                is_engl BOOL
-            );
-        """)
-        cursor.execute("SELECT word, is_engl FROM manual_class_cache;")
-        ret = {word: int(is_engl) for word, is_engl in cursor.fetchall()}
+    ret = {word: int(is_engl) for word, is_engl in lookup("SELECT word, is_engl FROM manual_class_cache", words)}
     print(f"manual class cache load took {time.time() - start:.3f}s")
     return ret
 
-def add_manual_lemma(words: List[Word]) -> List[Word]:
-    cache = load_manual_lemmas_cache()
-    for word in words:
-        word.manual_lemma = cache.get(word.word)
+def add_manual_lemma(words: WordTable) -> WordTable:
+    cache = load_manual_lemmas_cache(words.word.tolist())
+    words.manual_lemma = np.array([cache.get(w) for w in words.word], dtype=object)
     return words
 
-def load_manual_lemmas_cache():
+def load_manual_lemmas_cache(words: List[str]):
     start = time.time()
-    ret = {}
-    with sqlite3.connect(CACHE_DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS manual_lemma_cache (
-                word TEXT UNIQUE,
-                lemma TEXT UNIQUE
-            );
-        """)
-        cursor.execute("SELECT word, lemma FROM manual_lemma_cache;")
-        ret = {word: lemma for word, lemma in cursor.fetchall()}
+    ret = dict(lookup("SELECT word, lemma FROM manual_lemma_cache", words))
     print(f"manual class cache load took {time.time() - start:.3f}s")
     return ret
 
 @show_progress
-def remove_using_model(words: List[Word]) -> List[Word]:
-    import multiprocessing as mp
+def remove_using_model(words: WordTable) -> WordTable:
+    # whole candidate list in large batches, then only the lemmas of the rejected words
+    engl = words.keep.copy()
+    # loaded before the pool forks, workers share it
+    model()
     with mp.Pool(mp.cpu_count()) as pool:
-        res = pool.map(predict, words)
-    return [r for r in res if r]
-
-def predict(word: Word) -> Optional[Word]:
-    global model
-    if word.keep: return word
-    elif model.predict([word.word]): return word
-    elif model.predict([word.wn_lemma]): return word
-    return None
-
-def save(words: List[Word], path: str) -> None:
-    words.sort(key=lambda w: w.lemma())
+        candidates = np.flatnonzero(~engl)
+        engl[candidates] = predict(pool, words.word[candidates].tolist())
+        rejected = np.flatnonzero(~engl)
+        engl[rejected] = predict(pool, words.wn_lemma[rejected].tolist())
+    return words[engl]
+
+def predict(pool: mp.Pool, words: List[str]) -> List[bool]:
+    # only words the current model has not classified before go to the model
+    cache = load_prediction_cache(words)
+    todo = sorted(set(word for word in words if word not in cache))
+    predicted = [engl for batch in pool.map(predict_batch, list(chunks(todo, MODEL_BATCH))) for engl in batch]
+    save_prediction_cache(list(zip(todo, predicted)))
+    cache.update(zip(todo, predicted))
+    print(f"{len(todo)}/{len(set(words))} words not in model prediction cache")
+    return [cache[word] for word in words]
+
+def predict_batch(words: List[str]) -> List[bool]:
+    return [bool(label) for label in model().predict(words)]
+
+def load_prediction_cache(words: List[str]):
+    start = time.time()
+    rows = lookup("SELECT word, is_engl FROM model_prediction_cache", words, "model = ?", (model_sha1(),))
+    ret = {word: bool(is_engl) for word, is_engl in rows}
+    print(f"model prediction cache load took {time.time() - start:.3f}s")
+    return ret
+
+def save_prediction_cache(predictions):
+    conn = cache_db()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO model_prediction_cache VALUES (?, ?, ?);",
+                         [(word, model_sha1(), engl) for word, engl in predictions])
+
+def save(words: WordTable, path: str) -> None:
+    lemma = words.lemma()
+    # stable, same order as sorting the rows by lemma
+    order = sorted(range(len(words)), key=lemma.__getitem__)
     with open(path, "w") as f:
         f.write("word,lemma,frequency\n")
-        for word in words:
-            f.write(f"{word.word},{word.lemma()},{word.freq}\n")
-    print(f"saved {len(words)} words {len(set(w.lemma() for w in words))} lemmas in {path}")
+        for i in order:
+            f.write(f"{words.word[i]},{lemma[i]},{words.freq[i]}\n")
+    print(f"saved {len(words)} words {len(set(lemma))} lemmas in {path}")
 
 if __name__ == "__main__":
     process("word_list.csv")
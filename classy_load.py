@@ -0,0 +1,56 @@
+#!./venv/bin/python
+# load test for classy_server.py: concurrent clients post random words from a word list
+# and the latency percentiles and words/s are reported
+import sys, csv, json, random, threading, time, urllib.request
+
+from typing import List
+
+
+def post(url: str, words: List[str]) -> dict:
+    request = urllib.request.Request(f"{url}/classify", data=json.dumps({"words": words}).encode("utf8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def client(url: str, words: List[str], requests: int, size: int, seed: int, latencies: List[float], errors: List[str]) -> None:
+    rng = random.Random(seed)
+    for _ in range(requests):
+        batch = rng.sample(words, min(size, len(words)))
+        start = time.perf_counter()
+        try:
+            results = post(url, batch)["results"]
+            assert len(results) == len(batch), f"{len(results)} results for {len(batch)} words"
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+if __name__ == "__main__":
+    # ./classy_load.py <url> <word_list.csv> [clients] [requests-per-client] [words-per-request]
+    url, word_list_path = sys.argv[1].rstrip("/"), sys.argv[2]
+    args = [int(a) for a in sys.argv[3:]]
+    clients, requests, size = args + [16, 100, 1][len(args):]
+    with open(word_list_path, encoding="utf8") as f:
+        words = [row[0] for i, row in enumerate(csv.reader(f)) if i > 0 and row]
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(url, words, requests, size, seed, latencies, errors))
+               for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    took = time.perf_counter() - start
+
+    print(f"{clients} clients x {requests} requests x {size} words in {took:.2f}s, {len(errors)} errors")
+    for error in sorted(set(errors))[:5]: print(f"    {error}")
+    if latencies:
+        print(f"p50 {percentile(latencies, 0.5) * 1e3:.1f}ms  p99 {percentile(latencies, 0.99) * 1e3:.1f}ms  "
+              f"max {max(latencies) * 1e3:.1f}ms")
+        print(f"{len(latencies) / took:.0f} requests/s  {len(latencies) * size / took:.0f} words/s")
+    sys.exit(1 if errors else 0)
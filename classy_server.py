@@ -0,0 +1,171 @@
+#!./venv/bin/python
+# classy as a local http service: model, nltk data and cache connection are loaded once,
+# words of concurrent requests are collected into micro batches so every cache lookup and
+# model call covers many words, answers come from the caches where they can
+#   POST /classify {"words": ["weekend", ...]} -> {"results": [{"word", "engl", "stage", "hml_checked"}]}
+#   GET /health
+import sys, json, queue, threading, time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import numpy as np
+
+from classy import (AEIOUY_RE, PREFIXES, SUFFIXES, cache_db, has_triple_letter, lemmatize, lookup,
+                    save_prediction_cache, starts_with_double_vowel)
+from resources import model, model_sha1, stopwords
+
+HOST = "127.0.0.1"
+PORT = 8765
+# a batch is cut at MAX_BATCH words or MAX_WAIT seconds after its first request
+MAX_BATCH = 4096
+MAX_WAIT = 0.005
+# listen backlog, the default 5 drops connects of concurrent clients into 1s retransmits
+BACKLOG = 128
+
+
+def rule_stage(word: str, lemma: str, hml: Dict[str, bool], remove) -> str:
+    # first classy.process rule that drops the word, frequency is not known here
+    if len(word) <= 2: return "short"
+    if hml.get(word) or (hml.get(word) is not None and hml.get(lemma)): return "hml"
+    if has_triple_letter(word): return "triple-letter"
+    if AEIOUY_RE.search(word) is None: return "without-aeiouy"
+    if word.startswith(tuple(PREFIXES)): return "prefix"
+    if word.endswith(tuple(SUFFIXES)): return "suffix"
+    if starts_with_double_vowel(word): return "double-vowel-prefix"
+    if word in remove: return "stopword"
+    return ""
+
+
+def predict(words: List[str]) -> Dict[str, bool]:
+    # prediction cache first, the model only for the rest
+    rows = lookup("SELECT word, is_engl FROM model_prediction_cache", words, "model = ?", (model_sha1(),))
+    ret = {word: bool(is_engl) for word, is_engl in rows}
+    todo = sorted(set(words) - ret.keys())
+    if todo:
+        predicted = list(zip(todo, (bool(label) for label in model().predict(todo))))
+        save_prediction_cache(predicted)
+        ret.update(predicted)
+    return ret
+
+
+def classify(words: List[str]) -> List[Dict[str, object]]:
+    lemmas = lemmatize(np.array(words, dtype=object), verbose=False).tolist()
+    hml = {word: bool(found) for word, found in lookup("SELECT word, found FROM hml_cache", words + lemmas)}
+    manual = dict(lookup("SELECT word, is_engl FROM manual_class_cache", words + lemmas))
+    remove = stopwords()
+
+    results, undecided = [], []
+    for i, (word, lemma) in enumerate(zip(words, lemmas)):
+        # classy stops on words missing from the hml cache, here they go on unchecked
+        hml_checked = word in hml and (hml[word] or lemma in hml)
+        result = {"word": word, "engl": False, "stage": rule_stage(word, lemma, hml, remove), "hml_checked": hml_checked}
+        if not result["stage"]:
+            classes = (manual.get(word, -1), manual.get(lemma, -1))
+            if 0 in classes: result["stage"] = "manual"
+            elif 1 in classes: result.update(engl=True, stage="manual")
+            else: undecided.append(i)
+        results.append(result)
+
+    # surface forms first, lemmas only of the rejected ones
+    engl = predict([words[i] for i in undecided])
+    rejected = [i for i in undecided if not engl[words[i]]]
+    engl_lemma = predict([lemmas[i] for i in rejected])
+    for i in undecided:
+        results[i].update(engl=engl[words[i]] or engl_lemma.get(lemmas[i], False), stage="model")
+    return results
+
+
+class Batcher:
+    # one thread owns the sqlite connection and the model calls, requests wait on an event
+    def __init__(self) -> None:
+        self.inbox = queue.Queue()
+        self.batches = 0
+        self.words = 0
+        self.ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self.ready.wait()
+
+    def classify(self, words: List[str]) -> List[Dict[str, object]]:
+        request = {"words": words, "results": None, "error": None, "done": threading.Event()}
+        self.inbox.put(request)
+        request["done"].wait()
+        if request["error"] is not None: raise RuntimeError(request["error"])
+        return request["results"]
+
+    def _next_batch(self) -> List[dict]:
+        batch = [self.inbox.get()]
+        size, deadline = len(batch[0]["words"]), time.perf_counter() + MAX_WAIT
+        while size < MAX_BATCH:
+            try:
+                request = self.inbox.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request["words"])
+        return batch
+
+    def _run(self) -> None:
+        # everything loaded before the first request is accepted
+        cache_db(), model(), stopwords(), lemmatize(np.array(["warmup"], dtype=object), verbose=False)
+        self.ready.set()
+        while True:
+            batch = self._next_batch()
+            words = [word for request in batch for word in request["words"]]
+            try:
+                results = classify(words)
+            except Exception as e:
+                results, error = None, f"{type(e).__name__}: {e}"
+            else:
+                error = None
+            self.batches += 1
+            self.words += len(words)
+            offset = 0
+            for request in batch:
+                if results is not None: request["results"] = results[offset:offset + len(request["words"])]
+                request["error"] = error
+                offset += len(request["words"])
+                request["done"].set()
+
+
+class Handler(BaseHTTPRequestHandler):
+    batcher: Batcher = None
+
+    def _reply(self, code: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path != "/health": return self._reply(404, {"error": "not found"})
+        self._reply(200, {"batches": self.batcher.batches, "words": self.batcher.words})
+
+    def do_POST(self) -> None:
+        if self.path != "/classify": return self._reply(404, {"error": "not found"})
+        try:
+            words = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["words"]
+            assert isinstance(words, list) and all(isinstance(w, str) for w in words), "words must be a list of strings"
+        except Exception as e:
+            return self._reply(400, {"error": f"{type(e).__name__}: {e}"})
+        if not words: return self._reply(200, {"results": []})
+        try:
+            self._reply(200, {"results": self.batcher.classify([w.lower() for w in words])})
+        except RuntimeError as e:
+            self._reply(500, {"error": str(e)})
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    # ./classy_server.py [port]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    start = time.perf_counter()
+    Handler.batcher = Batcher()
+    ThreadingHTTPServer.request_queue_size = BACKLOG
+    server = ThreadingHTTPServer((HOST, port), Handler)
+    print(f"loaded in {time.perf_counter() - start:.3f}s, serving on http://{HOST}:{port}")
+    server.serve_forever()
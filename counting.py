@@ -0,0 +1,116 @@
+# memory bounded word counting for wordy.py, either exact by spilling sorted runs of counts
+# to disk and merging them at the end, or approximate with a count-min sketch that only
+# keeps words likely to be frequent
+import os, gzip, hashlib, heapq, tempfile
+
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+# classy.remove_infrequent_words drops everything with frequency <= 2
+MIN_FREQUENCY = 3
+
+
+class SpillCounter:
+    # counts in memory until max_words distinct words, then writes them sorted to a run file
+    def __init__(self, max_words: int, tmp_dir: str = None) -> None:
+        self.max_words = max_words
+        self.words = Counter()
+        self.dir = tempfile.TemporaryDirectory(prefix="wordy-spill-", dir=tmp_dir)
+        self.runs: List[str] = []
+
+    def update(self, words: Counter) -> None:
+        self.words.update(words)
+        if len(self.words) >= self.max_words: self.spill()
+
+    def spill(self) -> None:
+        if not self.words: return
+        path = os.path.join(self.dir.name, f"{len(self.runs)}.tsv.gz")
+        with gzip.open(path, "wt", encoding="utf8", compresslevel=1) as f:
+            for word in sorted(self.words):
+                f.write(f"{word}\t{self.words[word]}\n")
+        self.runs.append(path)
+        self.words = Counter()
+
+    def _read(self, path: str) -> Iterator[Tuple[str, int]]:
+        with gzip.open(path, "rt", encoding="utf8") as f:
+            for line in f:
+                word, count = line.rstrip("\n").split("\t")
+                yield word, int(count)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        # k-way merge of the sorted runs, one line of each run in memory at a time
+        self.spill()
+        merged = heapq.merge(*(self._read(path) for path in self.runs), key=itemgetter(0))
+        for word, counts in groupby(merged, key=itemgetter(0)):
+            yield word, sum(count for _, count in counts)
+
+    def close(self) -> None:
+        self.dir.cleanup()
+
+
+def word_hashes(words: Iterable[str]) -> np.ndarray:
+    # 64 bit hash per word, stable across processes unlike hash()
+    return np.array([int.from_bytes(hashlib.blake2b(w.encode("utf8"), digest_size=8).digest(), "little")
+                     for w in words], dtype=np.uint64)
+
+
+class CountMinSketch:
+    # depth rows of width counters, a word's estimate is the smallest of its counters and is
+    # never below the real count
+    def __init__(self, width: int, depth: int) -> None:
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.rows = np.arange(depth)
+
+    def indexes(self, hashes: np.ndarray) -> np.ndarray:
+        # double hashing, one column per row from the two halves of the hash
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        return ((h1[:, None] + self.rows.astype(np.uint64) * h2[:, None]) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, hashes: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        # conservative update, counters are only raised to the word's new estimate, which
+        # keeps the overcount of rare words much lower than adding to every row
+        indexes = self.indexes(hashes)
+        estimates = self.table[self.rows, indexes].min(axis=1) + counts.astype(np.uint32)
+        for row in self.rows:
+            np.maximum.at(self.table[row], indexes[:, row], estimates)
+        return estimates
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        return self.table[self.rows, self.indexes(hashes)].min(axis=1)
+
+
+class HeavyHitters:
+    # words whose estimate reached MIN_FREQUENCY, at most max_words of them, when full
+    # the less frequent half is dropped and the bar for new words raised to what was dropped
+    def __init__(self, max_words: int, width: int, depth: int) -> None:
+        self.max_words = max_words
+        self.sketch = CountMinSketch(width, depth)
+        self.words = {}
+        self.min_frequency = MIN_FREQUENCY
+
+    def update(self, vocab: List[str], counts: np.ndarray, hashes: np.ndarray) -> None:
+        estimates = self.sketch.add(hashes, counts)
+        for i in np.flatnonzero(estimates >= self.min_frequency).tolist():
+            self.words[vocab[i]] = hashes[i]
+        if len(self.words) > self.max_words: self.prune()
+
+    def prune(self) -> None:
+        words = list(self.words)
+        estimates = self.sketch.estimate(np.array(list(self.words.values()), dtype=np.uint64))
+        order = np.argsort(-estimates.astype(np.int64), kind="stable")
+        keep = order[:self.max_words // 2]
+        # max_words below 2 keeps nothing, the bar is then above every dropped word
+        self.min_frequency = max(self.min_frequency, int(estimates[keep[-1] if len(keep) else order[0]]) + 1)
+        self.words = {words[i]: self.words[words[i]] for i in keep.tolist()}
+
+    def items(self) -> List[Tuple[str, int]]:
+        if not self.words: return []
+        estimates = self.sketch.estimate(np.array(list(self.words.values()), dtype=np.uint64))
+        return list(zip(self.words, estimates.tolist()))
@@ -0,0 +1,103 @@
+# in-run dedup of parsed articles across sites: same url, same text, or near duplicate text
+# (minhash over word shingles, lsh bands to find candidates). signatures are computed in the
+# parse workers, the Deduper lives in the main process and is checked in a fixed file order, so
+# the same input always keeps the same canonical copies. an article only becomes a canonical once
+# it is written, copies of one that failed to write are not recorded as its duplicates
+import hashlib, re, threading, zlib
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+SHINGLE = 5
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+NEAR_DUPLICATE = 0.8
+PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(7)
+PERM_A = _rng.randint(1, 1 << 31, NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, 1 << 31, NUM_PERM).astype(np.uint64)
+WORD_RE = re.compile(r"\w+")
+URL_RE = re.compile(r"^(?:https?://)?(?:www\.)?([^?#]*?)/*(?:[?#].*)?$", re.IGNORECASE)
+
+# (url key, text hash, minhash signature)
+Signature = Tuple[int, int, bytes]
+# (kind, canonical sha1, site of the canonical, similarity)
+Duplicate = Tuple[str, str, str, float]
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf8"), digest_size=8).digest(), "little")
+
+
+def signature(url: str, text: str) -> Signature:
+    words = WORD_RE.findall(text.lower())
+    found = URL_RE.match(url.strip())
+    url_key = _hash64((found.group(1) if found else url).lower())
+    text_hash = _hash64(" ".join(words))
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(max(len(words) - SHINGLE + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    minhash = ((hashes[:, None] * PERM_A + PERM_B) % PRIME).min(axis=0).astype(np.uint32)
+    return url_key, text_hash, minhash.tobytes()
+
+
+class Deduper:
+    # first article seen is the canonical one, later copies point at it
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.canonical: List[str] = []
+        self.sites: List[str] = []
+        self.signatures = bytearray()
+        self.urls: Dict[int, int] = {}
+        self.texts: Dict[int, int] = {}
+        self.bands: List[Dict[int, int]] = [{} for _ in range(BANDS)]
+
+    def _similarity(self, doc: int, minhash: np.ndarray) -> float:
+        size = NUM_PERM * 4
+        other = np.frombuffer(self.signatures, dtype=np.uint32, count=NUM_PERM, offset=doc * size)
+        return float((other == minhash).mean())
+
+    @staticmethod
+    def _band_keys(minhash_bytes: bytes) -> List[int]:
+        return [hash(minhash_bytes[b * ROWS * 4:(b + 1) * ROWS * 4]) for b in range(BANDS)]
+
+    def check(self, sha1: str, sig: Signature) -> Optional[Duplicate]:
+        # only looks up, the article becomes a canonical with add once it is written
+        url_key, text_hash, minhash_bytes = sig
+        minhash = np.frombuffer(minhash_bytes, dtype=np.uint32)
+        with self.lock:
+            doc = self.urls.get(url_key)
+            if doc is not None and self.canonical[doc] != sha1:
+                return "url", self.canonical[doc], self.sites[doc], 1.0
+            doc = self.texts.get(text_hash)
+            if doc is not None and self.canonical[doc] != sha1:
+                return "exact", self.canonical[doc], self.sites[doc], 1.0
+            for band, key in zip(self.bands, self._band_keys(minhash_bytes)):
+                doc = band.get(key)
+                if doc is None or self.canonical[doc] == sha1: continue
+                similarity = self._similarity(doc, minhash)
+                if similarity >= NEAR_DUPLICATE:
+                    return "near", self.canonical[doc], self.sites[doc], similarity
+        return None
+
+    def add(self, sha1: str, site: str, sig: Signature) -> None:
+        url_key, text_hash, minhash_bytes = sig
+        with self.lock:
+            doc = len(self.canonical)
+            self.canonical.append(sha1)
+            self.sites.append(site)
+            self.signatures += minhash_bytes
+            self.urls.setdefault(url_key, doc)
+            self.texts.setdefault(text_hash, doc)
+            for band, key in zip(self.bands, self._band_keys(minhash_bytes)): band.setdefault(key, doc)
+
+    def __len__(self) -> int:
+        return len(self.canonical)
+
+    def truncate(self, size: int) -> None:
+        # forgets the canonicals added after the first size, for a batch that failed after they were written
+        with self.lock:
+            del self.canonical[size:], self.sites[size:], self.signatures[size * NUM_PERM * 4:]
+            for keys in (self.urls, self.texts, *self.bands):
+                for key in [key for key, doc in keys.items() if doc >= size]: del keys[key]
@@ -0,0 +1,105 @@
+# single pass text extraction for parser.py
+#
+# same result as extracting every tag in `remove` from the node and then calling
+# get_text, but the subtree is walked once and left untouched
+from typing import Callable, FrozenSet, List, Optional, Tuple
+
+from bs4.element import Tag
+
+from backends import LxmlTag, NON_TEXT_TAGS
+
+ParagraphFilter = Callable[[object], bool]
+
+
+class Paragraph:
+    __slots__ = ("strings", "skip")
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self.skip = False
+
+
+def _walk_soup(root: Tag, remove: FrozenSet[str], paragraph: Optional[ParagraphFilter],
+               skip_containing: Optional[str]) -> Tuple[List[str], List[Paragraph]]:
+    types = root.interesting_string_types
+    if isinstance(types, type): types = (types,)
+    strings, paragraphs, open_paragraphs = [], [], []
+    stack, closers = [iter(root.contents)], [None]
+    while stack:
+        for child in stack[-1]:
+            if isinstance(child, Tag):
+                if child.name in remove: continue
+                if child.name == skip_containing:
+                    for p in open_paragraphs: p.skip = True
+                p = None
+                if paragraph is not None and child.name == "p" and paragraph(child):
+                    p = Paragraph()
+                    paragraphs.append(p)
+                    open_paragraphs.append(p)
+                stack.append(iter(child.contents))
+                closers.append(p)
+                break
+            if type(child) in types:
+                strings.append(child)
+                for p in open_paragraphs: p.strings.append(child)
+        else:
+            stack.pop()
+            if closers.pop() is not None: open_paragraphs.pop()
+    return strings, paragraphs
+
+
+def _walk_lxml(root: LxmlTag, remove: FrozenSet[str], paragraph: Optional[ParagraphFilter],
+               skip_containing: Optional[str]) -> Tuple[List[str], List[Paragraph]]:
+    strings, paragraphs, open_paragraphs = [], [], []
+    def add(s: str) -> None:
+        strings.append(s)
+        for p in open_paragraphs: p.strings.append(s)
+
+    if root.el.text: add(root.el.text)
+    stack, closers = [iter(root.el)], [None]
+    while stack:
+        for child in stack[-1]:
+            name = child.tag
+            if not isinstance(name, str) or name in remove or name in NON_TEXT_TAGS:
+                # comments and dropped tags still leave their tail text behind
+                if child.tail: add(child.tail)
+                continue
+            if name == skip_containing:
+                for p in open_paragraphs: p.skip = True
+            p = None
+            if paragraph is not None and name == "p" and paragraph(LxmlTag(child)):
+                p = Paragraph()
+                paragraphs.append(p)
+                open_paragraphs.append(p)
+            if child.text: add(child.text)
+            stack.append(iter(child))
+            closers.append((p, child.tail))
+            break
+        else:
+            stack.pop()
+            closer = closers.pop()
+            if closer is None: continue
+            p, tail = closer
+            if p is not None: open_paragraphs.pop()
+            if tail: add(tail)
+    return strings, paragraphs
+
+
+def _walk(node, remove: FrozenSet[str], paragraph: Optional[ParagraphFilter] = None,
+          skip_containing: Optional[str] = None) -> Tuple[List[str], List[Paragraph]]:
+    if isinstance(node, LxmlTag):
+        return _walk_lxml(node, remove, paragraph, skip_containing)
+    return _walk_soup(node, remove, paragraph, skip_containing)
+
+
+def stripped_text(node, remove: FrozenSet[str], separator: str = "") -> str:
+    strings, _ = _walk(node, remove)
+    return separator.join(strings)
+
+
+def stripped_paragraphs(node, remove: FrozenSet[str], separator: str = "",
+                        paragraph: ParagraphFilter = lambda _: True,
+                        skip_containing: Optional[str] = None) -> List[str]:
+    # texts of the <p> tags left after removal, skip_containing drops paragraphs with such a tag inside
+    _, paragraphs = _walk(node, remove, paragraph, skip_containing)
+    return [separator.join(p.strings) for p in paragraphs if not p.skip]
@@ -0,0 +1,83 @@
+# word counts per facet (site and publish month) as a sparse vocab x facet matrix, saved as
+# an npz that scipy.sparse.load_npz reads directly, with the vocab and facet names alongside
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from shards import iso_date
+
+# (vocab joined by \n, facet names, row, column and count arrays) of one slice of files
+FacetPartial = Tuple[str, List[str], np.ndarray, np.ndarray, np.ndarray]
+# triplets summed into the matrix once this many are pending
+COMPACT_AT = 20_000_000
+
+
+def facet_name(site: str, publish_date: str) -> str:
+    # site and yyyy-mm
+    return f"{site}/{iso_date(publish_date)[:7]}"
+
+
+def to_facet_partial(counts: Dict[str, Counter]) -> FacetPartial:
+    vocab: Dict[str, int] = {}
+    rows, cols, data = [], [], []
+    for col, words in enumerate(counts.values()):
+        for word, count in words.items():
+            rows.append(vocab.setdefault(word, len(vocab)))
+            cols.append(col)
+            data.append(count)
+    return ("\n".join(vocab), list(counts),
+            np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32), np.array(data, dtype=np.int64))
+
+
+class FacetCounts:
+    def __init__(self) -> None:
+        self.vocab: Dict[str, int] = {}
+        self.facets: Dict[str, int] = {}
+        self.rows: List[np.ndarray] = []
+        self.cols: List[np.ndarray] = []
+        self.data: List[np.ndarray] = []
+        self.pending = 0
+
+    def add(self, partial: FacetPartial) -> None:
+        # renumbers the slice's words and facets into the global ids
+        vocab, facets, rows, cols, data = partial
+        if len(data) == 0: return
+        word_ids = np.array([self.vocab.setdefault(w, len(self.vocab)) for w in vocab.split("\n")], dtype=np.int32)
+        facet_ids = np.array([self.facets.setdefault(f, len(self.facets)) for f in facets], dtype=np.int32)
+        self.rows.append(word_ids[rows])
+        self.cols.append(facet_ids[cols])
+        self.data.append(data)
+        self.pending += len(data)
+        if self.pending >= COMPACT_AT: self.compact()
+
+    def compact(self) -> None:
+        matrix = self.matrix().tocoo()
+        self.rows, self.cols, self.data = [matrix.row.astype(np.int32)], [matrix.col.astype(np.int32)], [matrix.data]
+        self.pending = 0
+
+    def matrix(self) -> sparse.csr_matrix:
+        shape = (len(self.vocab), len(self.facets))
+        if not self.data: return sparse.csr_matrix(shape, dtype=np.int64)
+        # duplicates are summed on conversion
+        return sparse.coo_matrix(
+            (np.concatenate(self.data), (np.concatenate(self.rows), np.concatenate(self.cols))), shape=shape).tocsr()
+
+    def save(self, path: str) -> sparse.csr_matrix:
+        matrix = self.matrix()
+        sites, months = zip(*(f.split("/") for f in self.facets)) if self.facets else ((), ())
+        np.savez_compressed(path, format=b"csr", shape=matrix.shape, data=matrix.data, indices=matrix.indices,
+                            indptr=matrix.indptr, vocab=np.frombuffer("\n".join(self.vocab).encode("utf8"), dtype=np.uint8),
+                            sites=np.array(sites, dtype=str), months=np.array(months, dtype=str))
+        return matrix
+
+
+def load(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, sparse.csr_matrix]:
+    # vocab, site and month of every column, counts; for pandas:
+    # pd.DataFrame.sparse.from_spmatrix(m, index=vocab, columns=pd.MultiIndex.from_arrays([sites, months]))
+    with np.load(path) as f:
+        # joined by \n as utf8 bytes, a fixed width str array would be as wide as the longest word
+        vocab = f["vocab"].tobytes().decode("utf8")
+        return (np.array(vocab.split("\n") if vocab else [], dtype=object),
+                f["sites"], f["months"], sparse.load_npz(path))
@@ -0,0 +1,90 @@
+# sqlite record of every raw file parser.py has seen, lets a run skip unchanged
+# inputs and continue where an interrupted run stopped
+import os, sqlite3
+
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+# (site, name, size, mtime_ns, outcome, detail) where detail is the output path (relative
+# to the destination) for written files and the failure reason for failed ones
+Record = Tuple[str, str, int, int, str, Optional[str]]
+# (site, name, sha1, canonical sha1, kind, similarity, site of the canonical) of an article
+# not written because it duplicates one already written, kind is url, exact or near
+Cluster = Tuple[str, str, str, str, str, float, str]
+
+
+def manifest_path(dst: Path) -> Path:
+    # next to the destination, so scripts walking the parsed tree never see it
+    return dst.parent / f"{dst.name}.manifest.db"
+
+
+class Manifest:
+    def __init__(self, path: Path) -> None:
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS parsed_files (
+                site TEXT,
+                name TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                outcome TEXT,
+                detail TEXT,
+                PRIMARY KEY (site, name)
+            );
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS duplicates (
+                site TEXT,
+                name TEXT,
+                sha1 TEXT,
+                canonical TEXT,
+                kind TEXT,
+                similarity REAL,
+                canonical_site TEXT,
+                PRIMARY KEY (site, name)
+            );
+        """)
+        # manifests written before canonical_site was recorded
+        if "canonical_site" not in {row[1] for row in self.conn.execute("PRAGMA table_info(duplicates);")}:
+            self.conn.execute("ALTER TABLE duplicates ADD COLUMN canonical_site TEXT;")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical);")
+
+    def seen(self, site: str) -> Dict[str, Tuple[int, int]]:
+        cursor = self.conn.execute("SELECT name, size, mtime_ns FROM parsed_files WHERE site = ?;", (site,))
+        return {name: (size, mtime_ns) for name, size, mtime_ns in cursor}
+
+    def record(self, records: Iterable[Record]) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO parsed_files VALUES (?, ?, ?, ?, ?, ?);", records)
+
+    def record_duplicates(self, clusters: Iterable[Cluster]) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?, ?);", clusters)
+
+    def rebuild(self, site: str, dst: Path) -> int:
+        # forget the site and delete what it wrote, so a parser change can be rerun from scratch
+        cursor = self.conn.execute(
+            "SELECT DISTINCT detail FROM parsed_files WHERE site = ? AND outcome = 'written';", (site,))
+        removed, missing = 0, []
+        for (path,) in cursor.fetchall():
+            if os.path.exists(dst / path):
+                os.remove(dst / path)
+                removed += 1
+            else:
+                missing.append(str(dst / path))
+        if missing:
+            print(f"{len(missing)} outputs of {site} recorded in the manifest are not on disk, e.g. {missing[0]}")
+        with self.conn:
+            self.conn.execute("DELETE FROM parsed_files WHERE site = ?;", (site,))
+            self.conn.execute("DELETE FROM duplicates WHERE site = ?;", (site,))
+            # copies of the removed articles in other sites are parsed again, one of them becomes canonical
+            self.conn.execute("""
+                DELETE FROM parsed_files WHERE (site, name) IN (
+                    SELECT site, name FROM duplicates WHERE canonical_site = ?);
+            """, (site,))
+            self.conn.execute("DELETE FROM duplicates WHERE canonical_site = ?;", (site,))
+        return removed
+
+    def close(self) -> None:
+        self.conn.close()
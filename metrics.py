@@ -0,0 +1,122 @@
+# per site and per stage parse metrics, cheap to merge so every worker and thread keeps
+# its own and they are added together before the summary is written
+import json, re, time
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# bucket i counts durations below 2**i microseconds, the last one everything above
+BUCKETS = 32
+EXAMPLES = 3
+
+
+def metrics_path(dst: Path) -> Path:
+    return dst.parent / f"{dst.name}.metrics.json"
+
+
+def failure_class(e: Exception) -> str:
+    # numbers and dates in assertion messages would make every failure its own class
+    return f"{type(e).__name__}: {re.sub(r'[0-9]+', '#', str(e))[:120]}"
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th duration
+        target, seen = q * sum(self.counts), 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target: return min((2 ** i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, object]:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "total_s": round(self.total, 6),
+            "mean_ms": round(self.total / max(count, 1) * 1e3, 4),
+            "p50_ms": round(self.quantile(0.5) * 1e3, 4),
+            "p90_ms": round(self.quantile(0.9) * 1e3, 4),
+            "p99_ms": round(self.quantile(0.99) * 1e3, 4),
+            "max_ms": round(self.max * 1e3, 4),
+            "buckets_us_log2": self.counts,
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.timings: Dict[tuple, Histogram] = defaultdict(Histogram)
+        self.failures: Counter = Counter()
+        self.examples: Dict[tuple, List[str]] = defaultdict(list)
+        self.output_bytes: Counter = Counter()
+        self.outcomes: Counter = Counter()
+
+    def time(self, site: str, stage: str, seconds: float) -> None:
+        self.timings[site, stage].add(seconds)
+
+    def fail(self, site: str, stage: str, e: Exception, path: str) -> None:
+        key = (site, stage, failure_class(e))
+        self.failures[key] += 1
+        if len(self.examples[key]) < EXAMPLES: self.examples[key].append(path)
+
+    def merge(self, other: "Metrics") -> None:
+        for key, histogram in other.timings.items(): self.timings[key].merge(histogram)
+        self.failures.update(other.failures)
+        for key, paths in other.examples.items():
+            self.examples[key].extend(paths[:EXAMPLES - len(self.examples[key])])
+        self.output_bytes.update(other.output_bytes)
+        self.outcomes.update(other.outcomes)
+
+    def to_dict(self) -> Dict[str, object]:
+        sites = sorted({site for site, _ in self.timings} | {site for site, _ in self.outcomes})
+        ret = {}
+        for site in sites:
+            failures = defaultdict(dict)
+            for (s, stage, cls), count in self.failures.most_common():
+                if s == site:
+                    failures[stage][cls] = {"count": count, "examples": self.examples[s, stage, cls]}
+            ret[site] = {
+                "outcomes": {o: c for (s, o), c in sorted(self.outcomes.items()) if s == site},
+                "output_bytes": self.output_bytes[site],
+                "timings": {stage: h.to_dict() for (s, stage), h in self.timings.items() if s == site},
+                "failures": failures,
+            }
+        return ret
+
+    def write(self, path: Path, **extra) -> None:
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({**extra, "sites": self.to_dict()}, f, ensure_ascii=False, indent=1)
+
+
+class StageTimer:
+    # times consecutive steps of one page, stage is the step that was running when it failed
+    def __init__(self, metrics: Metrics, site: str) -> None:
+        self.metrics = metrics
+        self.site = site
+        self.stage: Optional[str] = None
+        self.started = 0.0
+
+    def start(self, stage: Optional[str]) -> None:
+        now = time.perf_counter()
+        if self.stage is not None: self.metrics.time(self.site, self.stage, now - self.started)
+        self.stage, self.started = stage, now
+
+    def stop(self) -> None:
+        self.start(None)
@@ -1,15 +1,24 @@
 #!./venv/bin/python
-import multiprocessing as mp, sys, os, gzip, json, hashlib, re, asyncio
+import multiprocessing as mp, sys, os, gzip, json, hashlib, re, queue, threading, time, traceback
 
+from itertools import chain
 from datetime import datetime
 from abc import ABC
 from pathlib import Path
-from typing import Generator, Tuple, Dict, Optional, List
+from typing import Generator, Tuple, Dict, Optional, List, FrozenSet
 from dataclasses import dataclass
 
 from tqdm import tqdm
 from bs4 import BeautifulSoup
 
+from backends import HTML_PARSER, make_soup
+from extraction import stripped_paragraphs, stripped_text
+from manifest import Cluster, Manifest, Record, manifest_path
+from pipeline import DONE, Stage, feed
+from shards import SHARD_SUFFIX, IndexRow, ShardIndex, ShardWriter
+from metrics import Metrics, StageTimer, metrics_path
+from dedup import Deduper, Signature, signature
+
 DATE_FORMAT = "%Y/%m/%d"
 START_DATE = datetime(2020, 1, 1)
 END_DATE = datetime(2024, 1, 1)
@@ -17,20 +26,80 @@ DATE_MAP = {"siječnja": 1, "siječanj": 1, "veljače": 2, "veljača": 2, "ožuj
             "svibnja": 5, "svibanj": 5, "lipnja": 6, "lipanj": 6, "srpnja": 7, "srpanj": 7, "kolovoza": 8, "kolovoz": 8,
             "rujna": 9, "rujan": 9, "listopada": 10, "listopad": 10, "studenog": 11, "studeni": 11, "studenoga": 11,
             "prosinca": 12, "prosinac": 12}
+READ_WORKERS = 8
+WRITE_WORKERS = 4
+PARSE_BATCH_SIZE = 64
+PARSE_BATCH_BYTES = 8 * 1024 * 1024
+
+# fast date probes work on the raw html string, they only have to be right when they
+# return a date, anything unclear returns None and the page goes through the full parse
+MONTH_RE = "|".join(sorted(DATE_MAP, key=len, reverse=True))
+CROATIAN_DATE_RE = re.compile(rf"(\d{{1,2}})\. ({MONTH_RE}) (\d{{4}})\.")
+
+def tag_re(tag: str, attr: str, value: str) -> re.Pattern:
+    # opening tag with attr == value, for class attr value only has to be one of the classes
+    value = re.escape(value)
+    if attr == "class": value = rf"""[^"']*(?<![\w-]){value}(?![\w-])[^"']*"""
+    return re.compile(rf"""<{tag}(?=\s)(?=[^>]*?\s{attr}\s*=\s*["']{value}["'])[^>]*>""", re.IGNORECASE)
+
+def attr_value(tag: str, attr: str) -> Optional[str]:
+    found = re.search(rf"""\s{attr}\s*=\s*(?:"([^"]*)"|'([^']*)')""", tag, re.IGNORECASE)
+    return None if found is None else (found.group(1) or found.group(2) or "")
+
+def probe_attr(content: str, pattern: re.Pattern, attr: str, only_one: bool) -> Optional[str]:
+    tags = pattern.findall(content)
+    if len(tags) == 0 or (only_one and len(tags) > 1): return None
+    return attr_value(tags[0], attr)
+
+def probe_text(content: str, pattern: re.Pattern, close: str, limit: int = 1000) -> Optional[str]:
+    found = pattern.search(content)
+    if found is None: return None
+    end = content.find(close, found.end(), found.end() + limit)
+    return None if end < 0 else content[found.end():end]
+
+def probe_strptime(date: Optional[str], fmt: str) -> Optional[datetime]:
+    if date is None: return None
+    try:
+        return datetime.strptime(date.strip(), fmt)
+    except ValueError:
+        return None
+
+def probe_croatian_date(text: Optional[str]) -> Optional[datetime]:
+    if text is None: return None
+    found = CROATIAN_DATE_RE.search(text)
+    if found is None: return None
+    day, month, year = found.groups()
+    try:
+        return datetime(int(year), DATE_MAP[month], int(day))
+    except ValueError:
+        return None
+
+PUBLISHED_TIME_RE = tag_re("meta", "property", "article:published_time")
 
 class Parser(ABC):
+    # tag holding the article text as (name, attrs) and tags dropped from it before taking the text
+    TEXT_TAG: Optional[Tuple[str, Dict[str, str]]] = None
+    REMOVE_TAGS: FrozenSet[str] = frozenset()
+    def __init__(self, backend: str = HTML_PARSER):
+        self.backend = backend
     def url(self, _: BeautifulSoup) -> Optional[str]:
         raise NotImplemented
     def title(self, _: BeautifulSoup) -> str:
         raise NotImplemented
-    def text(self, _: BeautifulSoup) -> str:
-        raise NotImplemented
+    def text(self, soup: BeautifulSoup) -> str:
+        assert self.TEXT_TAG is not None, "text tag not set"
+        text = soup.find(*self.TEXT_TAG)
+        assert text is not None, "text not found"
+        return stripped_text(text, self.REMOVE_TAGS, "\n").strip()
     def date(self, _: BeautifulSoup) -> str:
         raise NotImplemented
+    def probe_date(self, _: str) -> Optional[datetime]:
+        return None
 
 
 class HrtParser(Parser):
-    def __init__(self):
+    def __init__(self, backend: str = HTML_PARSER):
+        super().__init__(backend)
         self.date_re = re.compile(r"\d{2}\.\d{2}\.(\d){4}\.") 
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("meta", {"property": "og:url"})
@@ -52,13 +121,9 @@ class HrtParser(Parser):
         return ret
 
 class DirektnoParser(Parser):
-    def __init__(self):
-        self.REMOVE_TAGS = ["blockquote", "script", "iframe", "span",
-               "a", "em", "style", "figure", "g", "img",
-               "path", "sup", "svg", "time"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS: 
-            for it in html(tag): it.extract()
+    REMOVE_TAGS = frozenset(["blockquote", "script", "iframe", "span",
+                             "a", "em", "style", "figure", "g", "img",
+                             "path", "sup", "svg", "time"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         url = soup.find("meta", {"property": "og:url"})
         assert url is not None, "cannot find url"
@@ -73,24 +138,23 @@ class DirektnoParser(Parser):
         dates = [date for date in dates if date is not None]
         assert len(dates) == 1, f"unexpected number of dates {dates}"
         return datetime.strptime(dates[0].strip(), "%Y-%m-%d").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        return probe_strptime(probe_attr(content, PUBLISHED_TIME_RE, "content", True), "%Y-%m-%d")
     def text(self, soup: BeautifulSoup) -> str:
         main = soup.find_all("div", {"class": "main-content"})
         assert len(main) == 1, "unexpected len of main content"
-        main = main[0]
-        self.remove_tags(main)
-        content = main.find_all("p", attrs=lambda x: not x)
+        content = stripped_paragraphs(main[0], self.REMOVE_TAGS, "\n", paragraph=lambda p: not p.get("class"))
         assert len(content) > 0, "no text found"
-        return "\n".join([c.getText("\n").strip() for c in content])
+        return "\n".join([c.strip() for c in content])
 
 class VecernjiParser(Parser):
-    def __init__(self):
+    DATE_PUBLISHED_RE = tag_re("meta", "itemprop", "datePublished")
+    REMOVE_TAGS = frozenset(["blockquote", "script", "iframe", "span",
+                             "a", "em", "style", "figure", "g", "img",
+                             "path", "sup", "svg", "time"])
+    def __init__(self, backend: str = HTML_PARSER):
+        super().__init__(backend)
         self.date_re = re.compile(r"\d{4}\-\d{2}\-(\d){2}")
-        self.REMOVE_TAGS = ["blockquote", "script", "iframe", "span",
-               "a", "em", "style", "figure", "g", "img",
-               "path", "sup", "svg", "time"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS: 
-            for it in html(tag): it.extract()
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         url = soup.find("meta", {"property": "og:url"})
         assert url is not None, "cannot find url"
@@ -106,23 +170,21 @@ class VecernjiParser(Parser):
         date = dates[0].get("content").strip()
         assert self.date_re.match(date) is not None, "date not found"
         return datetime.strptime(date, "%Y-%m-%d").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        return probe_strptime(probe_attr(content, self.DATE_PUBLISHED_RE, "content", True), "%Y-%m-%d")
     def text(self, soup: BeautifulSoup) -> str:
         articles = [a for a in soup.find_all("article") if "single-article" in a.get("class", [])]
         assert len(articles) > 0, "cannot find article"
-        for a in articles: self.remove_tags(a)
-        ps = [p for a in articles for p in a.find_all("p")]
+        ps = [p for a in articles for p in stripped_paragraphs(a, self.REMOVE_TAGS, skip_containing="div")]
         assert len(ps) > 0, "cannot find paragraphs"
-        ret = "\n\n".join([p.get_text() for p in ps if not p.find("div")])
+        ret = "\n\n".join(ps)
         assert len(ret) > 10, "text too short"
         return ret
 
 class NoviListParser(Parser):
-    REMOVE_TAGS = ["blockquote", "script", "iframe", "span",
-                    "a", "em", "style", "figure", "g", "img",
-                    "path", "sup", "svg", "time", "strong", "video", "font", "div"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
+    REMOVE_TAGS = frozenset(["blockquote", "script", "iframe", "span",
+                             "a", "em", "style", "figure", "g", "img",
+                             "path", "sup", "svg", "time", "strong", "video", "font", "div"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         url = soup.find("meta", {"property": "og:url"})
         assert url is not None, "cannot find url"
@@ -139,23 +201,24 @@ class NoviListParser(Parser):
         assert len(dates) == 1, f'unexpedted numbed of dates {len(dates)}'
         date = dates[0].get("content").strip()
         return datetime.strptime(date, "%Y-%m-%dT%H:%M:%S%z").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        date = probe_strptime(probe_attr(content, PUBLISHED_TIME_RE, "content", True), "%Y-%m-%dT%H:%M:%S%z")
+        return None if date is None else datetime(date.year, date.month, date.day)
     def text(self, soup: BeautifulSoup) -> str:
         intro = soup.find("p", {"class": "intro-text"})
         intro = "" if intro is None else intro.get_text().strip()
         article = soup.find("div", {"class": "user-content"})
         assert article is not None and len(article) > 0, "cannot find article"
-        self.remove_tags(article)
-        text = article.get_text().strip()
+        text = stripped_text(article, self.REMOVE_TAGS).strip()
         text = "\n".join((intro, text)).strip()
         assert len(text) > 0, "text content not found"
         return text
 
 class Sata24Parser(Parser):
-    REMOVE_TAGS = ["a", "script", "blockquote", "iframe", "em", "styple", "source", "video-js", "img", "span",
-                   "input", "ul", "figure"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
+    DATE_TAG_RE = tag_re("time", "class", "article__time")
+    TEXT_TAG = ("div", {"class": "article__body"})
+    REMOVE_TAGS = frozenset(["a", "script", "blockquote", "iframe", "em", "styple", "source", "video-js", "img", "span",
+                             "input", "ul", "figure"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         url = soup.find("meta", {"property": "og:url"})
         assert url is not None, "cannot find url"
@@ -171,20 +234,19 @@ class Sata24Parser(Parser):
         date = date.get("datetime")
         assert date is not None, "cannot find date"
         return datetime.strptime(date, "%Y-%m-%d").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        date = probe_attr(content, self.DATE_TAG_RE, "datetime", False)
+        return None if date is None or date != date.strip() else probe_strptime(date, "%Y-%m-%d")
     def text(self, soup: BeautifulSoup) -> str:
-        article = soup.find("div", {"class": "article__body"})
-        assert article is not None, "cannot find article"
-        self.remove_tags(article)
-        ret =  article.getText("\n").strip()
+        ret = super().text(soup)
         assert len(ret) > 0, "cannot find article content"
         return ret
 
 class DnevnoParser(Parser):
-    REMOVE_TAGS = ["div", "img", "a", "h1", "style", "time", "script", "blockquote",
-                   "ins", "h3", "article", "video", "em", "iframe", "img"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
+    DATE_TAG_RE = tag_re("time", "class", "date")
+    TEXT_TAG = ("div", {"id": "content"})
+    REMOVE_TAGS = frozenset(["div", "img", "a", "h1", "style", "time", "script", "blockquote",
+                             "ins", "h3", "article", "video", "em", "iframe", "img"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("meta", {"property": "og:url"})
         assert ret is not None, "cannot find url"
@@ -194,21 +256,18 @@ class DnevnoParser(Parser):
     def title(self, soup: BeautifulSoup) -> str:
         title = soup.find("h1")
         return "" if title is None else title.getText("\n").strip()
-    def text(self, soup: BeautifulSoup) -> str:
-        text = soup.find("div", {"id": "content"})
-        assert text is not None, "text not found"
-        self.remove_tags(text)
-        return text.getText("\n").strip()
     def date(self, soup: BeautifulSoup) -> str:
         date = soup.find("time", {"class": "date"})
         assert date is not None, "cannot find date"
         return datetime.strptime(date.get("datetime"), "%Y-%m-%d").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        date = probe_attr(content, self.DATE_TAG_RE, "datetime", False)
+        return None if date is None or date != date.strip() else probe_strptime(date, "%Y-%m-%d")
 
 class SlobodnaParser(Parser):
-    REMOVE_TAGS = ["a", "figure", "div", "script", "blockquote", "em", "style", "video", "img", "iframe"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
+    DATE_TAG_RE = tag_re("div", "class", "item__dates")
+    TEXT_TAG = ("div", {"class": "itemFullText"})
+    REMOVE_TAGS = frozenset(["a", "figure", "div", "script", "blockquote", "em", "style", "video", "img", "iframe"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("meta", {"property": "og:url"})
         assert ret is not None, "cannot find url"
@@ -218,23 +277,20 @@ class SlobodnaParser(Parser):
     def title(self, soup: BeautifulSoup) -> str:
         title = soup.find("h1")
         return "" if title is None else title.getText("\n").strip()
-    def text(self, soup: BeautifulSoup) -> str:
-        text = soup.find("div", {"class": "itemFullText"})
-        assert text is not None, "text not found"
-        self.remove_tags(text)
-        return text.getText("\n").strip()
     def date(self, soup: BeautifulSoup) -> str:
         date = soup.find("div", {"class": "item__dates"})
         assert date is not None, "cannot find date"
         date = date.getText("\n").split("-")[0].strip()
         day, month, year = date.replace(".", "").split(" ")
         return f"{year}/{DATE_MAP[month]}/{day}"
+    def probe_date(self, content: str) -> Optional[datetime]:
+        text = probe_text(content, self.DATE_TAG_RE, "<")
+        return None if text is None or not CROATIAN_DATE_RE.fullmatch(text.split("-")[0].strip()) else probe_croatian_date(text)
 
 class IndexhrParser(Parser):
-    REMOVE_TAGS = ["script", "span", "img", "a", "i", "blockquote", "iframe", "em", "style", "video", "font"]
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
+    DATE_TAG_RE = tag_re("div", "class", "article-info")
+    TEXT_TAG = ("div", {"class": "content-holder"})
+    REMOVE_TAGS = frozenset(["script", "span", "img", "a", "i", "blockquote", "iframe", "em", "style", "video", "font"])
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("link", {"rel": "og:url"})
         assert ret is not None, "cannot find url"
@@ -243,24 +299,19 @@ class IndexhrParser(Parser):
         return ret.strip()
     def title(self, soup: BeautifulSoup) -> str:
         return soup.find("h1", {"class": "title"}).getText("\n").strip()
-    def text(self, soup: BeautifulSoup) -> str:
-        text = soup.find("div", {"class": "content-holder"})
-        assert text is not None, "text not found"
-        self.remove_tags(text)
-        return text.getText("\n").strip()
     def date(self, soup: BeautifulSoup) -> str:
         date = soup.find("div", {"class": "article-info"}).getText("\n").strip()
         dates = re.findall(r"\d+\.\s.*\s\d+.", date)
         assert len(dates) >= 1, "date not found"
         day, month, year = dates[0].replace(".", "").split(" ")
         return f"{year}/{DATE_MAP[month]}/{day}"
+    def probe_date(self, content: str) -> Optional[datetime]:
+        return probe_croatian_date(probe_text(content, self.DATE_TAG_RE, "</div>"))
 
 class JutarnjiParser(Parser):
-    REMOVE_TAGS = ["a", "blockquote", "script", "iframe", "em", "style", "video", "img"]
+    DATE_TAG_RE = tag_re("span", "class", "item__author__date")
+    REMOVE_TAGS = frozenset(["a", "blockquote", "script", "iframe", "em", "style", "video", "img"])
     DATE_RE = re.compile(r"\d+\.\s.*\s\d+\.")
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("meta", {"property": "og:url"})
         assert ret is not None, "cannot find url"
@@ -273,10 +324,9 @@ class JutarnjiParser(Parser):
     def text(self, soup: BeautifulSoup) -> str:
         text = soup.find("div", {"class": "itemFullText"})
         assert text is not None, "cannot find text"
-        self.remove_tags(text)
-        ps = text.find_all("p")
+        ps = stripped_paragraphs(text, self.REMOVE_TAGS, "\n")
         assert len(ps) > 0, "cannot find paragraphs"
-        return "\n".join([p.getText("\n").strip() for p in ps])
+        return "\n".join([p.strip() for p in ps])
     def date(self, soup: BeautifulSoup) -> str:
         date = soup.find("span", {"class": "item__author__date"})
         assert date is not None, "cannot find date"
@@ -285,13 +335,15 @@ class JutarnjiParser(Parser):
         assert len(dates) == 1, f"unexpected number of dates {dates}"
         day, month, year = dates[0].replace(".", "").split(" ")
         return f"{year}/{DATE_MAP[month]}/{day}"
+    def probe_date(self, content: str) -> Optional[datetime]:
+        text = probe_text(content, self.DATE_TAG_RE, "</span>")
+        return None if text is None or len(CROATIAN_DATE_RE.findall(text)) != 1 else probe_croatian_date(text)
 
 class TelegramParser(Parser):
-    REMOVE_TAGS = ["a", "span", "blockquote", "script", "iframe", "em", "style", "video", "img"]
+    DATE_TAG_RE = tag_re("span", "class", "meta-date")
+    TEXT_TAG = ("div", {"id": "article-content"})
+    REMOVE_TAGS = frozenset(["a", "span", "blockquote", "script", "iframe", "em", "style", "video", "img"])
     DATE_RE = re.compile(r"\d+\.\s.*\s\d+\.")
-    def remove_tags(self, html: BeautifulSoup) -> None:
-        for tag in self.REMOVE_TAGS:
-            for it in html.find_all(tag): it.extract()
     def url(self, soup: BeautifulSoup) -> Optional[str]:
         ret = soup.find("meta", {"property": "og:url"})
         assert ret is not None, "cannot find url"
@@ -301,102 +353,364 @@ class TelegramParser(Parser):
     def title(self, soup: BeautifulSoup) -> str:
         title = soup.find("h1")
         return "" if title is None else title.getText("\n").strip()
-    def text(self, soup: BeautifulSoup) -> str:
-        text = soup.find("div", {"id": "article-content"})
-        assert text is not None, "cannot find text"
-        self.remove_tags(text)
-        return text.getText("\n").strip()
     def date(self, soup: BeautifulSoup) -> str:
         date = soup.find("span", {"class": "meta-date"})
         assert date is not None, "cannot find date"
         return datetime.strptime(date.getText("\n").strip(), "%d. %m. %Y.").strftime(DATE_FORMAT)
+    def probe_date(self, content: str) -> Optional[datetime]:
+        return probe_strptime(probe_text(content, self.DATE_TAG_RE, "<"), "%d. %m. %Y.")
 
+# html backend per site, move a site to LXML or LXML_NATIVE only after
+# ./backend_check.py reports no mismatches for it
 PARSER_MAP = {
-    "hrt": HrtParser(),
-    "direktno": DirektnoParser(),
-    "vecernji": VecernjiParser(),
-    "novilist": NoviListParser(),
-    "24sata": Sata24Parser(),
-    "dnevno": DnevnoParser(),
-    "slobodnadalmacija": SlobodnaParser(),
-    "indexhr": IndexhrParser(),
-    "jutarnji": JutarnjiParser(),
-    "telegram": TelegramParser(),
+    "hrt": HrtParser(backend=HTML_PARSER),
+    "direktno": DirektnoParser(backend=HTML_PARSER),
+    "vecernji": VecernjiParser(backend=HTML_PARSER),
+    "novilist": NoviListParser(backend=HTML_PARSER),
+    "24sata": Sata24Parser(backend=HTML_PARSER),
+    "dnevno": DnevnoParser(backend=HTML_PARSER),
+    "slobodnadalmacija": SlobodnaParser(backend=HTML_PARSER),
+    "indexhr": IndexhrParser(backend=HTML_PARSER),
+    "jutarnji": JutarnjiParser(backend=HTML_PARSER),
+    "telegram": TelegramParser(backend=HTML_PARSER),
 }
 
 @dataclass
 class File:
     src_path: Path
     dst_path: Path
-    parser: Parser
+    site: str
+    size: int
+    mtime_ns: int
+    # position in discovery order, the order dedup sees the files in
+    seq: int = 0
+
+    @property
+    def parser(self) -> Parser:
+        # looked up instead of stored so the parser is not pickled with every file
+        return PARSER_MAP[self.site]
+
 
+def get_site_files(src: Path, dst: Path, site: str, manifest: Manifest, ordered: bool = False) -> Generator[File, File, None]:
+    seen = manifest.seen(site)
+    print(f"{site} ({len(seen)} in manifest)")
+    with os.scandir(src / site) as entries:
+        for entry in (sorted(entries, key=lambda e: e.name) if ordered else entries):
+            if not entry.name.endswith(".gz") or not entry.is_file(): continue
+            stat = entry.stat()
+            # unchanged since the last run
+            if seen.get(entry.name) == (stat.st_size, stat.st_mtime_ns): continue
+            yield File(src / site / entry.name, dst / site, site, stat.st_size, stat.st_mtime_ns)
 
-def get_files(src: Path, dst: Path) -> Generator[File, File, None]:
-    for folder in os.listdir(src):
-        if folder not in PARSER_MAP: continue
-        if not (src / folder).is_dir(): continue
-        print(folder)
-        for file in os.listdir(src / folder):
-            if not file.endswith(".gz"): continue
-            yield File(src / folder / file, dst / folder, PARSER_MAP[folder])
+def interleave(streams: List[Generator[File, File, None]]) -> Generator[File, File, None]:
+    while streams:
+        for stream in list(streams):
+            file = next(stream, None)
+            if file is None: streams.remove(stream)
+            else: yield file
 
-def to_batches(batch_size: int, gen: Generator[File, File, None]) -> Generator[List[File], List[File], None]:
+def get_files(src: Path, dst: Path, ordered: bool = False) -> Generator[File, File, None]:
+    # own connection, the pipeline consumes this generator from its feed thread
+    manifest = Manifest(manifest_path(dst))
+    with os.scandir(src) as entries:
+        sites = sorted(e.name for e in entries if e.name in PARSER_MAP and e.is_dir())
+    streams = [get_site_files(src, dst, site, manifest, ordered) for site in sites]
+    # streams every site at once, round robin, so slow pages of one site are spread over the run,
+    # ordered goes by site and name instead, the order dedup needs
+    for seq, file in enumerate(chain.from_iterable(streams) if ordered else interleave(streams)):
+        file.seq = seq
+        yield file
+
+# (file, decompressed json or None, read error)
+Raw = Tuple[File, Optional[bytes], Optional[str]]
+# (sha1 of url, id, publish_date, json, dedup signature) of an article to write
+Article = Tuple[str, Optional[str], str, str, Optional[Signature]]
+# (file, outcome, detail, article to write)
+Parsed = Tuple[File, str, Optional[str], Optional[Article]]
+
+def in_range(date: datetime) -> bool:
+    return START_DATE <= date < END_DATE
+
+# metrics of the main process, read and write threads and parse results are merged into it
+METRICS = Metrics()
+METRICS_LOCK = threading.Lock()
+
+def merge_metrics(metrics: Metrics) -> None:
+    with METRICS_LOCK:
+        METRICS.merge(metrics)
+
+def read_files(files: List[File]) -> List[Raw]:
     ret = []
-    for item in gen: 
-        ret.append(item)
-        if len(ret) == batch_size:
-            yield ret
-            ret = []
-    yield ret
-
-def load_json(path: Path) -> Tuple[Dict[str, str], BeautifulSoup]:
-    with gzip.open(path, "rt", encoding="UTF-8") as f:
-        data = json.load(f)
-        html = BeautifulSoup(data["content"], "html.parser")
-        del data["content"]
-    return data, html
-
-
-async def process(file: File) -> None:
+    metrics = Metrics()
+    for file in files:
+        timer = StageTimer(metrics, file.site)
+        timer.start("read")
+        try:
+            with open(file.src_path, "rb") as f:
+                ret.append((file, gzip.decompress(f.read()), None))
+            timer.stop()
+        except Exception as e:
+            metrics.fail(file.site, "read", e, str(file.src_path))
+            ret.append((file, None, f"{type(e).__name__}: {e}"))
+    merge_metrics(metrics)
+    return ret
+
+def process(file: File, raw: bytes, metrics: Metrics, dedup: bool = False) -> Tuple[str, Optional[str], Optional[Article]]:
+    timer = StageTimer(metrics, file.site)
     try:
-        data, html = load_json(file.src_path)
+        timer.start("json")
+        data = json.loads(raw)
 
+        # reject out of range pages before paying for the html tree
+        timer.start("probe")
+        probed_date = file.parser.probe_date(data["content"])
+        if probed_date is not None and not in_range(probed_date):
+            timer.stop()
+            return "probed-out-of-range", None, None
+        timer.start("soup")
+        html = make_soup(data.pop("content"), file.parser.backend)
+
+        timer.start("url")
         url = file.parser.url(html)
         if url is None:
-            return
+            timer.stop()
+            return "no-url", None, None
         data["url"] = url
+        timer.start("date")
         data["publish_date"] = file.parser.date(html)
-        if not (START_DATE <= datetime.strptime(data["publish_date"], DATE_FORMAT) < END_DATE):
-            return
+        if not in_range(datetime.strptime(data["publish_date"], DATE_FORMAT)):
+            timer.stop()
+            return "out-of-range", None, None
 
+        timer.start("title")
         title = file.parser.title(html)
+        timer.start("text")
         text = "\n".join([title, file.parser.text(html)]).strip()
         assert len(text) > 0, "text too short"
         data["text"] = text
 
-        save_path = file.dst_path
-        for part in data["publish_date"].split("/"): save_path = save_path / part
-        save_path = save_path / f"{hashlib.sha1(data['url'].encode()).hexdigest()}.json"
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        # shingling is the expensive part of dedup, done here so it runs in the pool
+        sig = None
+        if dedup:
+            timer.start("dedup")
+            sig = signature(url, text)
 
-        with open(save_path, "w", encoding="utf8") as f:
-            json.dump(data, f, ensure_ascii=False)
+        timer.start("serialize")
+        sha1 = hashlib.sha1(data["url"].encode()).hexdigest()
+        article = (sha1, data.get("id"), data["publish_date"], json.dumps(data, ensure_ascii=False), sig)
+        timer.stop()
+        return "written", None, article
     except Exception as e:
         print(f"{file.src_path=} -> {e}")
+        metrics.fail(file.site, timer.stage, e, str(file.src_path))
+        return "failed", f"{type(e).__name__}: {e}", None
+
+def process_batch(batch: List[Raw], dedup: bool = False) -> Tuple[List[Parsed], Metrics]:
+    ret = []
+    metrics = Metrics()
+    for file, raw, error in batch:
+        if raw is None:
+            print(f"{file.src_path=} -> {error}")
+            ret.append((file, "failed", error, None))
+        else:
+            ret.append((file, *process(file, raw, metrics, dedup)))
+    return ret, metrics
+
+def parse_in_pool(pool: mp.Pool, batch: List[Raw], dedup: bool = False) -> List[Parsed]:
+    parsed, metrics = pool.apply(process_batch, (batch, dedup))
+    merge_metrics(metrics)
+    return parsed
+
+def failed_batch(stage: str, files: List[File], e: Exception) -> None:
+    metrics = Metrics()
+    for file in files:
+        print(f"{file.src_path=} -> {e}")
+        metrics.fail(file.site, stage, e, str(file.src_path))
+        if stage == "write": metrics.outcomes[file.site, "failed"] += 1
+    merge_metrics(metrics)
+
+# a batch a stage raised on goes on as failed files, the same as a single file failing
+def read_failed(batch: List[File], e: Exception) -> List[Raw]:
+    failed_batch("read", batch, e)
+    return [(file, None, f"{type(e).__name__}: {e}") for file in batch]
+
+def parse_failed(batch: List[Raw], e: Exception) -> List[Parsed]:
+    failed_batch("parse", [file for file, _, _ in batch], e)
+    return [(file, "failed", f"{type(e).__name__}: {e}", None) for file, _, _ in batch]
+
+def write_failed(batch: List[Parsed], e: Exception) -> List[Record]:
+    # the manifest write may be what failed, the files are parsed again next run
+    failed_batch("write", [file for file, _, _, _ in batch], e)
+    return [(file.site, file.src_path.name, file.size, file.mtime_ns, "failed", f"{type(e).__name__}: {e}")
+            for file, _, _, _ in batch]
+
+class Writer:
+    # writes parsed articles off the parse path and records them in the manifest once on disk,
+    # either one json per article or appended to per site and month shards, with a deduper
+    # duplicates of an already written article only go to the cluster table. dedup needs a
+    # single writer thread, it takes the files in discovery order whatever order they are
+    # parsed in, so the first copy by site and name is always the canonical one
+    def __init__(self, dst: Path, shards: bool, deduper: Optional[Deduper] = None) -> None:
+        self.dst = dst
+        self.local = threading.local()
+        self.created_dirs = set()
+        self.shards = ShardWriter() if shards else None
+        # shards appended to or holding a member superseded this run, compacted on close
+        self.touched = set()
+        self.touched_lock = threading.Lock()
+        self.deduper = deduper
+        self.pending: Dict[int, Parsed] = {}
+        self.next_seq = 0
+
+    def write_file(self, file: File, article: Article) -> str:
+        sha1, _, publish_date, data, _ = article
+        save_path = file.dst_path
+        for part in publish_date.split("/"): save_path = save_path / part
+        if save_path not in self.created_dirs:
+            os.makedirs(save_path, exist_ok=True)
+            self.created_dirs.add(save_path)
+        save_path = save_path / f"{sha1}.json"
+        data = data.encode("utf8")
+        with open(save_path, "wb") as f:
+            f.write(data)
+        self.local.metrics.output_bytes[file.site] += len(data)
+        # relative, the manifest stays valid whatever directory the next run starts in
+        return str(save_path.relative_to(self.dst))
+
+    def write_shard(self, file: File, article: Article) -> Tuple[str, IndexRow]:
+        sha1, id, publish_date, data, _ = article
+        date = datetime.strptime(publish_date, DATE_FORMAT)
+        shard = str(Path(file.site) / f"{date:%Y}" / f"{date:%m}{SHARD_SUFFIX}")
+        offset, length = self.shards.append(str(self.dst / shard), data)
+        self.local.metrics.output_bytes[file.site] += length
+        return shard, (sha1, id, f"{date:{DATE_FORMAT}}", file.site, shard, offset, length)
+
+    def __call__(self, batch: List[Parsed]) -> List[Record]:
+        if self.deduper is None: return self.write(batch)
+        for parsed in batch: self.pending[parsed[0].seq] = parsed
+        ready = []
+        while self.next_seq in self.pending:
+            ready.append(self.pending.pop(self.next_seq))
+            self.next_seq += 1
+        if not ready: return []
+        canonicals = len(self.deduper)
+        try:
+            return self.write(ready)
+        except Exception as e:
+            traceback.print_exc()
+            # none of the batch is recorded as written, so none of it may be a canonical
+            self.deduper.truncate(canonicals)
+            return write_failed(ready, e)
 
-def process_batch(batch: List[File]):
-    async def inner():
-        await asyncio.gather(*(process(f) for f in batch))
-    asyncio.run(inner())
-    return len(batch)
+    def write(self, batch: List[Parsed]) -> List[Record]:
+        if not hasattr(self.local, "manifest"):
+            self.local.manifest = Manifest(manifest_path(self.dst))
+            self.local.index = ShardIndex(self.dst) if self.shards else None
+        self.local.metrics = Metrics()
+        records, index_rows = [], []
+        clusters: List[Cluster] = []
+        for file, outcome, detail, article in batch:
+            if article is not None and self.deduper is not None and article[4] is not None:
+                duplicate = self.deduper.check(article[0], article[4])
+                if duplicate is not None:
+                    kind, canonical, canonical_site, similarity = duplicate
+                    clusters.append((file.site, file.src_path.name, article[0], canonical, kind, similarity, canonical_site))
+                    outcome, detail, article = "duplicate", canonical, None
+            if article is not None:
+                timer = StageTimer(self.local.metrics, file.site)
+                timer.start("write")
+                try:
+                    if self.shards is None:
+                        detail = self.write_file(file, article)
+                    else:
+                        detail, row = self.write_shard(file, article)
+                        index_rows.append(row)
+                    timer.stop()
+                    # canonical only once written, later copies of a failed write are kept as articles
+                    if self.deduper is not None and article[4] is not None:
+                        self.deduper.add(article[0], file.site, article[4])
+                except Exception as e:
+                    print(f"{file.src_path=} -> {e}")
+                    self.local.metrics.fail(file.site, "write", e, str(file.src_path))
+                    outcome, detail = "failed", f"{type(e).__name__}: {e}"
+            self.local.metrics.outcomes[file.site, outcome] += 1
+            records.append((file.site, file.src_path.name, file.size, file.mtime_ns, outcome, detail))
+        if self.shards is not None:
+            self.shards.flush()
+            touched = self.local.index.shards_of(row[0] for row in index_rows) | {row[4] for row in index_rows}
+            with self.touched_lock: self.touched |= touched
+            self.local.index.add(index_rows)
+        self.local.manifest.record(records)
+        if clusters: self.local.manifest.record_duplicates(clusters)
+        merge_metrics(self.local.metrics)
+        return records
+
+    def close(self) -> None:
+        if self.pending: print(f"{len(self.pending)} parsed files never reached the writer in order, not written")
+        if self.shards is None: return
+        self.shards.close()
+        # an article parsed again is appended, not replaced, the old member goes here
+        index = ShardIndex(self.dst)
+        dropped = [index.compact(shard) for shard in sorted(self.touched)]
+        index.close()
+        if any(dropped):
+            print(f"compacted {sum(1 for d in dropped if d)} shards, {sum(dropped)} stale bytes dropped")
 
 if __name__ == "__main__":
-    _, src_root, dst_root = sys.argv
-    files = get_files(Path(src_root), Path(dst_root))
-    batched_files = to_batches(128, files)
+    # any extra args are sites to parse again from scratch, e.g. after a parser change,
+    # --shards writes jsonl shards with an offset index instead of one json per article,
+    # --dedup skips articles whose url or text (also near duplicate) was already written this run,
+    # earlier by site and file name
+    shards = "--shards" in sys.argv
+    dedup = "--dedup" in sys.argv
+    src_root, dst_root, *rebuild_sites = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    manifest = Manifest(manifest_path(Path(dst_root)))
+    index = ShardIndex(Path(dst_root)) if shards else None
+    for site in rebuild_sites:
+        assert site in PARSER_MAP, f"unknown site {site}"
+        print(f"rebuilding {site}, removed {manifest.rebuild(site, Path(dst_root))} parsed files")
+        if index is not None: index.forget(site)
+    manifest.close()
+    if index is not None: index.close()
+    writer = Writer(Path(dst_root), shards, Deduper() if dedup else None)
 
+    # discover -> read + decompress (threads) -> parse (process pool) -> write (threads)
+    # bounded queues between the stages keep memory flat when one of them falls behind
+    to_read, to_parse, to_write, done = (queue.Queue(maxsize=n) for n in (4096, 512, 1024, 0))
+    start = time.perf_counter()
     progress_bar = tqdm(desc="Processing", unit="item")
     with mp.Pool(mp.cpu_count()) as p:
-        for count in p.imap(process_batch, batched_files):
-            progress_bar.update(count)
+        feed(get_files(Path(src_root), Path(dst_root), ordered=dedup), to_read)
+        stages = [
+            Stage("read", read_files, to_read, to_parse, workers=READ_WORKERS, batch_size=8, on_error=read_failed).start(),
+            # batches are cut by size, a few huge live blogs do not hold up a worker for long
+            Stage("parse", lambda batch: parse_in_pool(p, batch, dedup), to_parse, to_write,
+                  workers=mp.cpu_count(), batch_size=PARSE_BATCH_SIZE,
+                  cost=lambda raw: len(raw[1] or b""), batch_cost=PARSE_BATCH_BYTES, on_error=parse_failed).start(),
+            Stage("write", writer, to_write, done, workers=1 if dedup else WRITE_WORKERS, batch_size=256,
+                  on_error=write_failed).start(),
+        ]
+        last_sample = 0.0
+        while True:
+            try:
+                record = done.get(timeout=0.5)
+            except queue.Empty:
+                record = None
+            if time.perf_counter() - last_sample > 0.5:
+                last_sample = time.perf_counter()
+                for stage in stages: stage.sample()
+                progress_bar.set_postfix({stage.name: stage.inbox.qsize() for stage in stages})
+            if record is DONE: break
+            if record is None: continue
+            progress_bar.update(1)
     progress_bar.close()
+    writer.close()
+
+    wall = time.perf_counter() - start
+    for stage in stages: print(stage.summary(wall))
+
+    outcomes = METRICS.outcomes
+    for site in sorted({site for site, _ in outcomes}):
+        print(site, ", ".join(f"{outcome}={count}" for (s, outcome), count in sorted(outcomes.items()) if s == site))
+    METRICS.write(metrics_path(Path(dst_root)), wall_s=round(wall, 3), stages=[stage.summary(wall) for stage in stages])
+    print(f"metrics written to {metrics_path(Path(dst_root))}")
@@ -0,0 +1,112 @@
+#!./venv/bin/python
+# offline parser benchmark: runs every site parser on the pages in fixtures/ with each html
+# backend and checks url/date/title/text against the golden outputs. the fixtures are small
+# synthetic pages with the markup each parser expects, too small to time, so pages/s and peak
+# memory per site and backend are only measured on a sample of real raw pages (--raw)
+import multiprocessing as mp, sys, os, gzip, json, resource, time
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from backends import BACKENDS, HTML_PARSER, make_soup
+from parser import DATE_FORMAT, PARSER_MAP
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FIELDS = ("url", "date", "title", "text")
+# raw pages per site timed with --raw
+RAW_SAMPLE = 50
+
+
+def golden_path(site: str) -> Path:
+    return FIXTURES / f"{site}.golden.json"
+
+
+def parse_page(site: str, backend: str, content: str) -> Dict[str, str]:
+    # same call order as parser.process, text() has to be last
+    parser = type(PARSER_MAP[site])(backend=backend)
+    html = make_soup(content, backend)
+    return {field: getattr(parser, field)(html) for field in FIELDS}
+
+
+def raw_pages(src: Path, site: str) -> List[str]:
+    # html of the first RAW_SAMPLE crawled pages of the site, the input parser.py reads
+    paths = sorted(path for path in (src / site).glob("*.gz"))[:RAW_SAMPLE] if (src / site).is_dir() else []
+    return [json.loads(gzip.decompress(path.read_bytes()))["content"] for path in paths]
+
+
+def rss_kb() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def bench(args) -> Dict[str, object]:
+    # runs in a fresh process so peak rss belongs to this site and backend only
+    site, backend, iterations, raw = args
+    content = (FIXTURES / f"{site}.html").read_text(encoding="utf8")
+    try:
+        result = parse_page(site, backend, content)
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    probed = PARSER_MAP[site].probe_date(content)
+    ret = {"result": result, "probe": None if probed is None else f"{probed:{DATE_FORMAT}}",
+           "pages": 0, "pages_per_s": None, "peak_rss_growth_kb": None}
+    pages = raw_pages(raw, site) if raw is not None else []
+    if not pages: return ret
+    before = rss_kb()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for page in pages:
+            try:
+                parse_page(site, backend, page)
+            except Exception:
+                pass
+    took = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ret.update(pages=len(pages), pages_per_s=iterations * len(pages) / took, peak_rss_growth_kb=max(peak - before, 0))
+    return ret
+
+
+def check(backend: str, res: Dict[str, object], golden: Dict[str, str]) -> list:
+    result = res["result"]
+    errors = [f"{f}: {golden.get(f)!r:.60} != {result.get(f, result.get('error'))!r:.60}"
+              for f in FIELDS if result.get(f) != golden.get(f)]
+    if backend == HTML_PARSER and res["probe"] is not None and golden.get("date") is not None:
+        # probe only needs to agree on the day, parsers do not always zero pad
+        if res["probe"] != time.strftime(DATE_FORMAT, time.strptime(golden["date"], DATE_FORMAT)):
+            errors.append(f"probe: {golden['date']!r} != {res['probe']!r}")
+    return errors
+
+
+if __name__ == "__main__":
+    # --update-golden rewrites the golden outputs from the html.parser results,
+    # --raw=<src-path> times every parser and backend on real crawled pages of parser.py's input
+    update = "--update-golden" in sys.argv
+    raw: Optional[Path] = next((Path(a.split("=", 1)[1]) for a in sys.argv[1:] if a.startswith("--raw=")), None)
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    iterations = int(args[0]) if args else 5
+    sites = sorted(site for site in PARSER_MAP if (FIXTURES / f"{site}.html").exists())
+
+    failed = False
+    if raw is None: print("fixtures are synthetic and only checked, pass --raw=<src-path> to time real pages")
+    print(f"{'site':<18} {'backend':<12} {'pages':>5} {'pages/s':>9} {'rss+kb':>7}  check")
+    for site in sites:
+        for backend in BACKENDS:
+            with mp.Pool(1, maxtasksperchild=1) as p:
+                res = p.apply(bench, ((site, backend, iterations, raw),))
+            if update and backend == HTML_PARSER:
+                assert "error" not in res["result"], f"{site} fixture fails to parse: {res['result']['error']}"
+                with open(golden_path(site), "w", encoding="utf8") as f:
+                    json.dump(res["result"], f, ensure_ascii=False, indent=1)
+            golden = json.loads(golden_path(site).read_text(encoding="utf8"))
+            errors = check(backend, res, golden)
+            # only the backend a site is configured with has to match
+            configured = PARSER_MAP[site].backend == backend
+            failed |= configured and len(errors) > 0
+            status = "ok" if not errors else ("FAIL" if configured else "differs")
+            timing = (f"{res['pages_per_s']:9.1f} {res['peak_rss_growth_kb']:7}" if res["pages"]
+                      else f"{'-':>9} {'-':>7}")
+            print(f"{site:<18} {backend:<12} {res['pages']:5} {timing}  {status}")
+            for error in errors:
+                print(f"    {error}")
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,112 @@
+# small thread based pipeline: stages connected by bounded queues, each stage runs
+# its function in a few threads and keeps enough stats to tell which stage is the limit
+import queue, threading, time, traceback
+
+from typing import Any, Callable, Iterable, List, Optional
+
+DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[List[Any]], Iterable[Any]], inbox: queue.Queue,
+                 outbox: Optional[queue.Queue], workers: int = 1, batch_size: int = 1,
+                 cost: Optional[Callable[[Any], int]] = None, batch_cost: int = 0,
+                 on_error: Optional[Callable[[List[Any], Exception], Iterable[Any]]] = None) -> None:
+        # fn takes a batch of up to batch_size items (and up to batch_cost when cost is given)
+        # and returns items for the next stage, on_error gives the items for a batch fn raised on
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.batch_size = batch_size
+        self.cost = cost
+        self.batch_cost = batch_cost
+        self.on_error = on_error
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.running = workers
+        self.threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self) -> "Stage":
+        for t in self.threads: t.start()
+        return self
+
+    def _next_batch(self) -> List[Any]:
+        # block for the first item, then take whatever is already waiting
+        batch, total = [], 0
+        item = self.inbox.get()
+        while item is not DONE:
+            batch.append(item)
+            if len(batch) == self.batch_size: break
+            if self.cost is not None:
+                total += self.cost(item)
+                if total >= self.batch_cost: break
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+        if item is DONE:
+            # let the other workers of this stage see it too
+            self.inbox.put(DONE)
+            batch.append(DONE)
+        return batch
+
+    def _run(self) -> None:
+        finished = False
+        while not finished:
+            batch = self._next_batch()
+            finished = batch[-1] is DONE
+            if finished: batch.pop()
+            if len(batch) == 0: continue
+            start = time.perf_counter()
+            try:
+                out = self.fn(batch)
+            except Exception as e:
+                # a broken batch must not stall the stages after this one
+                traceback.print_exc()
+                out = self.on_error(batch, e) if self.on_error is not None else []
+                with self.lock: self.failed += len(batch)
+            took = time.perf_counter() - start
+            with self.lock:
+                self.items += len(batch)
+                self.busy += took
+            if self.outbox is not None:
+                for item in out: self.outbox.put(item)
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last and self.outbox is not None:
+            self.outbox.put(DONE)
+
+    def sample(self) -> None:
+        depth = self.inbox.qsize()
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+        self.samples += 1
+
+    def summary(self, wall: float) -> str:
+        avg_depth = self.depth_sum / max(self.samples, 1)
+        per_worker = self.items / max(self.busy, 1e-9)
+        return (f"{self.name:<8} {self.items:>10} items {self.items / max(wall, 1e-9):10.1f}/s "
+                f"({per_worker:.1f}/s per busy worker, {self.workers} workers, "
+                f"{self.busy / max(wall * self.workers, 1e-9) * 100:.0f}% busy) "
+                f"queue avg {avg_depth:.1f} max {self.depth_max}/{self.inbox.maxsize}"
+                + (f", {self.failed} items in failed batches" if self.failed else ""))
+
+
+def feed(items: Iterable[Any], outbox: queue.Queue) -> threading.Thread:
+    def run():
+        # DONE even when items raises, or the stages wait for it forever
+        try:
+            for item in items: outbox.put(item)
+        finally:
+            outbox.put(DONE)
+    t = threading.Thread(target=run, name="feed", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,87 @@
+# nltk data and the classifier are looked up locally and loaded on first use, once per
+# process. importing a script costs nothing and pool workers forked after the first load
+# share it. nothing is downloaded when the data is already installed, so batch nodes
+# without network only need nltk_data provisioned
+import functools, os, pickle, hashlib
+
+from typing import TYPE_CHECKING, Callable, FrozenSet, List, Union
+
+if TYPE_CHECKING:
+    from nltk.stem import WordNetLemmatizer
+    from sklearn.pipeline import Pipeline
+    from scorer import Scorer
+
+NLTK_RESOURCES = {"punkt": "tokenizers/punkt", "wordnet": "corpora/wordnet", "stopwords": "corpora/stopwords"}
+MODEL_PATH = "NGRAM_SVC.pkl"
+# written by ./scorer.py export, used instead of the pickle when exported from it
+SCORER_PATH = "NGRAM_SVC.npz"
+
+
+def file_sha1(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def require_nltk(name: str) -> None:
+    import nltk
+    try:
+        nltk.data.find(NLTK_RESOURCES[name])
+        return
+    except LookupError:
+        pass
+    # not installed locally, the only case that touches the network
+    if not nltk.download(name, quiet=True):
+        raise LookupError(f"nltk {name} is not installed and could not be downloaded, "
+                          f"run `python -m nltk.downloader {name}` on a machine with network and copy nltk_data")
+
+
+@functools.lru_cache(maxsize=None)
+def sentence_tokenizer() -> Callable[[str], List[str]]:
+    require_nltk("punkt")
+    from nltk.tokenize import sent_tokenize
+    # the punkt pickle only loads on the first call, made here so workers forked later have it
+    sent_tokenize("x.")
+    return sent_tokenize
+
+
+def sent_tokenize(text: str) -> List[str]:
+    return sentence_tokenizer()(text)
+
+
+@functools.lru_cache(maxsize=None)
+def stopwords() -> FrozenSet[str]:
+    # stopwords of every language nltk has
+    require_nltk("stopwords")
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words())
+
+
+@functools.lru_cache(maxsize=None)
+def lemmatizer() -> "WordNetLemmatizer":
+    require_nltk("wordnet")
+    from nltk.stem import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+    # wordnet is a lazy corpus, read on the first lemmatize
+    lemmatizer.lemmatize("x")
+    return lemmatizer
+
+
+@functools.lru_cache(maxsize=None)
+def model() -> Union["Pipeline", "Scorer"]:
+    # both predict 1 for english on a list of words
+    if os.path.exists(SCORER_PATH):
+        from scorer import Scorer
+        scorer = Scorer(SCORER_PATH)
+        # the pickle does not have to be shipped next to it
+        if not os.path.exists(MODEL_PATH) or scorer.model_sha1 == file_sha1(MODEL_PATH): return scorer
+        print(f"{SCORER_PATH} is not exported from {MODEL_PATH}, using the pipeline")
+    with open(MODEL_PATH, "rb") as f:
+        return pickle.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def model_sha1() -> str:
+    # identifies the model whichever file it is loaded from, a new model gets new cache keys
+    if os.path.exists(MODEL_PATH): return file_sha1(MODEL_PATH)
+    from scorer import Scorer
+    return Scorer(SCORER_PATH).model_sha1
@@ -0,0 +1,119 @@
+#!./venv/bin/python
+# standalone scorer exported from NGRAM_SVC.pkl (char n-gram CountVectorizer + linear SVC):
+# the weight of every n-gram in an open addressing hash table of 64 bit fingerprints plus
+# the intercept, scored with numpy only, so classification needs neither sklearn nor the
+# pickle on the nodes
+import sys, os, csv, pickle, re, time, zlib
+
+from typing import List, Tuple
+
+import numpy as np
+
+from resources import MODEL_PATH, SCORER_PATH, file_sha1
+
+WHITE_SPACES = re.compile(r"\s\s+")
+
+
+def fingerprint(ngram: str) -> int:
+    # crc32 in the low bits, they pick the slot; 0 marks an empty slot
+    data = ngram.encode("utf8")
+    return ((zlib.adler32(data) << 32) | zlib.crc32(data)) or 1
+
+
+def char_ngrams(word: str, min_n: int, max_n: int) -> List[str]:
+    # same n-grams as CountVectorizer(analyzer="char"), lowercase and whitespace folded
+    word = WHITE_SPACES.sub(" ", word.lower())
+    return [word[i:i + n] for n in range(min_n, max_n + 1) for i in range(len(word) - n + 1)]
+
+
+def export(model_path: str, path: str) -> None:
+    model = pickle.load(open(model_path, "rb"))
+    vectorizer, svc = model.steps[0][1], model.steps[-1][1]
+    assert vectorizer.analyzer == "char" and vectorizer.lowercase and not vectorizer.binary, "unsupported vectorizer"
+    assert svc.kernel == "linear" and list(svc.classes_) == [0, 1], "unsupported classifier"
+    weights = np.asarray(svc.coef_.todense() if hasattr(svc.coef_, "todense") else svc.coef_).ravel()
+    vocabulary = vectorizer.vocabulary_
+
+    size = 1 << (2 * len(vocabulary)).bit_length()
+    keys = np.zeros(size, dtype=np.uint64)
+    values = np.zeros(size, dtype=np.float64)
+    for ngram, column in vocabulary.items():
+        key = fingerprint(ngram)
+        slot = key & (size - 1)
+        while keys[slot] != 0:
+            assert keys[slot] != key, f"fingerprint collision on {ngram!r}"
+            slot = (slot + 1) & (size - 1)
+        keys[slot], values[slot] = key, weights[column]
+    np.savez(path, keys=keys, values=values, intercept=np.float64(svc.intercept_[0]),
+             ngram_range=np.array(vectorizer.ngram_range), model_sha1=np.array(file_sha1(model_path)))
+
+
+class Scorer:
+    def __init__(self, path: str) -> None:
+        with np.load(path) as f:
+            self.keys = f["keys"]
+            self.values = f["values"]
+            self.intercept = float(f["intercept"])
+            self.min_n, self.max_n = (int(n) for n in f["ngram_range"])
+            self.model_sha1 = str(f["model_sha1"])
+        self.mask = np.uint64(len(self.keys) - 1)
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        # linear probing for all keys at once, missing n-grams weigh 0
+        slots = keys & self.mask
+        ret = np.zeros(len(keys), dtype=np.float64)
+        todo = np.arange(len(keys))
+        while len(todo):
+            found = self.keys[slots[todo]]
+            hit = found == keys[todo]
+            ret[todo[hit]] = self.values[slots[todo[hit]]]
+            todo = todo[~hit & (found != 0)]
+            slots[todo] = (slots[todo] + np.uint64(1)) & self.mask
+        return ret
+
+    def decision_function(self, words: List[str]) -> np.ndarray:
+        ngrams = [char_ngrams(word, self.min_n, self.max_n) for word in words]
+        lengths = np.fromiter((len(n) for n in ngrams), dtype=np.int64, count=len(words))
+        keys = np.fromiter((fingerprint(n) for ns in ngrams for n in ns), dtype=np.uint64, count=int(lengths.sum()))
+        owner = np.repeat(np.arange(len(words)), lengths)
+        return np.bincount(owner, weights=self.lookup(keys), minlength=len(words)) + self.intercept
+
+    def predict(self, words: List[str]) -> np.ndarray:
+        # same labels as the pipeline, 1 for english
+        return (self.decision_function(words) > 0).astype(np.int64)
+
+
+def check(words: List[str], scorer_path: str, model_path: str) -> Tuple[int, float, float]:
+    # mismatching decisions and words/s of the pipeline and the scorer
+    model = pickle.load(open(model_path, "rb"))
+    scorer = Scorer(scorer_path)
+    assert scorer.model_sha1 == file_sha1(model_path), f"{scorer_path} was exported from another model"
+    start = time.perf_counter()
+    expected = model.predict(words)
+    model_took = time.perf_counter() - start
+    start = time.perf_counter()
+    got = scorer.predict(words)
+    scorer_took = time.perf_counter() - start
+    for i in np.flatnonzero(expected != got)[:20].tolist():
+        print(f"    {words[i]!r}: pipeline {expected[i]} scorer {got[i]}")
+    return int((expected != got).sum()), len(words) / model_took, len(words) / scorer_took
+
+
+def load_word_list(path: str) -> List[str]:
+    with open(path, encoding="utf8") as f:
+        return [row[0] for i, row in enumerate(csv.reader(f)) if i > 0 and row]
+
+
+if __name__ == "__main__":
+    # ./scorer.py export <word_list.csv>  exports and keeps the scorer only if it agrees on every word
+    # ./scorer.py check <word_list.csv>   parity and words/s against the pipeline
+    _, command, word_list_path = sys.argv
+    words = load_word_list(word_list_path)
+    if command == "export":
+        export(MODEL_PATH, SCORER_PATH)
+    mismatches, model_wps, scorer_wps = check(words, SCORER_PATH, MODEL_PATH)
+    print(f"{len(words)} words, {mismatches} mismatches, pipeline {model_wps:.0f} words/s, scorer {scorer_wps:.0f} words/s")
+    if mismatches and command == "export":
+        os.remove(SCORER_PATH)
+        print(f"{SCORER_PATH} removed")
+    sys.exit(1 if mismatches else 0)
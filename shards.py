@@ -0,0 +1,167 @@
+#!./venv/bin/python
+# sharded output of parser.py: articles appended to <site>/<yyyy>/<mm>.jsonl.gz, one gzip
+# member per article so a shard reads as a normal gzip stream and any article can be read
+# alone from its offset, offsets are kept in the sqlite index next to the destination. an
+# article parsed again is appended too, shards a run touched are compacted to the members
+# the index points at when it ends, so readers streaming a shard see every article once
+import sys, os, gzip, json, sqlite3, threading
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+SHARD_SUFFIX = ".jsonl.gz"
+# (sha1 of url, id, publish_date, site, shard relative to the destination, offset, length)
+IndexRow = Tuple[str, Optional[str], str, str, str, int, int]
+
+
+def index_path(dst: Path) -> Path:
+    return dst.parent / f"{dst.name}.index.db"
+
+
+def is_article_file(name: str) -> bool:
+    return name.endswith(".json") or name.endswith(SHARD_SUFFIX)
+
+
+def iso_date(publish_date: str) -> str:
+    # publish_date of parser.py output, some parsers do not zero pad month and day
+    year, month, day = publish_date.split("/")
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def slices(files: Iterable[str], size: int) -> Iterator[List[str]]:
+    # consecutive files of at least size bytes on disk, except the last slice
+    files_slice, slice_size = [], 0
+    for path in files:
+        files_slice.append(path)
+        slice_size += os.path.getsize(path)
+        if slice_size >= size:
+            yield files_slice
+            files_slice, slice_size = [], 0
+    if files_slice: yield files_slice
+
+
+def load_articles(path: str) -> Iterator[Dict[str, str]]:
+    # works for both output modes of parser.py, a single json or a shard
+    if path.endswith(SHARD_SUFFIX):
+        with gzip.open(path, "rt", encoding="utf8") as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        with open(path, "rb") as f:
+            yield json.load(f)
+
+
+def read_article(shard: str, offset: int, length: int) -> Dict[str, str]:
+    with open(shard, "rb") as f:
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(length)))
+
+
+class ShardWriter:
+    # appends to shards from several writer threads, one open handle and lock per shard
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.shards: Dict[str, Tuple[object, threading.Lock]] = {}
+
+    def _shard(self, path: str):
+        with self.lock:
+            if path not in self.shards:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.shards[path] = (open(path, "ab"), threading.Lock())
+            return self.shards[path]
+
+    def append(self, path: str, line: str) -> Tuple[int, int]:
+        member = gzip.compress((line + "\n").encode("utf8"), mtime=0)
+        f, lock = self._shard(path)
+        with lock:
+            offset = f.tell()
+            f.write(member)
+        return offset, len(member)
+
+    def flush(self) -> None:
+        with self.lock:
+            shards = list(self.shards.values())
+        for f, lock in shards:
+            with lock: f.flush()
+
+    def close(self) -> None:
+        for f, _ in self.shards.values(): f.close()
+        self.shards = {}
+
+
+class ShardIndex:
+    # of the shards under dst, kept relative to it so the index works from any directory
+    def __init__(self, dst: Path) -> None:
+        self.dst = dst
+        self.conn = sqlite3.connect(index_path(dst), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                sha1 TEXT PRIMARY KEY,
+                id TEXT,
+                publish_date TEXT,
+                site TEXT,
+                shard TEXT,
+                offset INTEGER,
+                length INTEGER
+            );
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS articles_id ON articles (id);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS articles_date ON articles (publish_date);")
+
+    def add(self, rows: List[IndexRow]) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?);", rows)
+
+    def forget(self, site: str) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM articles WHERE site = ?;", (site,))
+
+    def shards_of(self, sha1s: Iterable[str]) -> Set[str]:
+        # shards holding the current member of these articles, superseded when they are written again
+        sha1s = list(sha1s)
+        ret = set()
+        for i in range(0, len(sha1s), 500):
+            chunk = sha1s[i:i + 500]
+            cursor = self.conn.execute(
+                f"SELECT DISTINCT shard FROM articles WHERE sha1 IN ({','.join('?' * len(chunk))});", chunk)
+            ret.update(shard for (shard,) in cursor)
+        return ret
+
+    def compact(self, shard: str) -> int:
+        # rewrites the shard with only the members the index points at, dropping those of articles
+        # written again and of batches appended but never indexed, returns the bytes dropped
+        rows = self.conn.execute(
+            "SELECT sha1, offset, length FROM articles WHERE shard = ? ORDER BY offset;", (shard,)).fetchall()
+        shard = str(self.dst / shard)
+        size = os.path.getsize(shard) if os.path.exists(shard) else 0
+        if sum(length for _, _, length in rows) == size: return 0
+        offsets = []
+        with open(shard, "rb") as src, open(f"{shard}.tmp", "wb") as dst:
+            for sha1, offset, length in rows:
+                src.seek(offset)
+                offsets.append((dst.tell(), sha1))
+                dst.write(src.read(length))
+        with self.conn:
+            self.conn.executemany("UPDATE articles SET offset = ? WHERE sha1 = ?;", offsets)
+            os.replace(f"{shard}.tmp", shard)
+        return size - os.path.getsize(shard)
+
+    def find(self, key: str) -> Optional[Tuple[str, int, int]]:
+        # key is either the sha1 of the url or the raw page id, the shard path comes back resolved
+        found = self.conn.execute(
+            "SELECT shard, offset, length FROM articles WHERE sha1 = ? OR id = ? LIMIT 1;", (key, key)).fetchone()
+        if found is None: return None
+        shard, offset, length = found
+        return str(self.dst / shard), offset, length
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    _, dst_root, key = sys.argv
+    index = ShardIndex(Path(dst_root))
+    found = index.find(key)
+    assert found is not None, f"{key} not in index"
+    print(json.dumps(read_article(*found), ensure_ascii=False, indent=2))
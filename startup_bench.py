@@ -0,0 +1,32 @@
+#!./venv/bin/python
+# cold start of every script: a fresh interpreter importing it (what each forked or spawned
+# worker and every wrong-arguments run pays), then the first-use cost of the lazy resources
+import sys, subprocess, statistics, time
+
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+SCRIPTS = ("parser", "wordy", "classy", "txt_corpus", "archive")
+RESOURCES = ("sentence_tokenizer", "stopwords", "lemmatizer", "model")
+
+
+def run(code: str, stderr=None) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=stderr)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # ./startup_bench.py [runs]
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = statistics.median(run("pass") for _ in range(runs))
+    print(f"{'interpreter':<32} {baseline * 1e3:8.1f} ms")
+    for script in SCRIPTS:
+        took = statistics.median(run(f"import {script}") for _ in range(runs))
+        print(f"{'import ' + script:<32} {took * 1e3:8.1f} ms  (+{(took - baseline) * 1e3:.1f})")
+    for resource in RESOURCES:
+        try:
+            took = run(f"import resources; resources.{resource}()", stderr=subprocess.DEVNULL)
+            print(f"{'first ' + resource + '()':<32} {took * 1e3:8.1f} ms  (+{(took - baseline) * 1e3:.1f})")
+        except subprocess.CalledProcessError:
+            print(f"{'first ' + resource + '()':<32} {'missing':>8}")
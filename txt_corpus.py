@@ -1,24 +1,157 @@
 #!./venv/bin/python
-import multiprocessing as mp, sys, os, json, gzip
-from typing import Generator
+# texts of all articles in one compressed file. workers load and compress about BLOCK_BYTES of
+# article files at a time into a complete gzip member (xz stream, zstd frame), the parent only
+# concatenates them in file order, so the output is deterministic and reads as one stream with
+# gzip -d (xz -d, zstd -d)
+# with --shards=N the selected articles go to N train shards and val shards instead, jsonl with one
+# gzip member per article and an offset index, like parser.py --shards, so loaders read any shard
+# or article on its own
+import multiprocessing as mp, sys, os, re, json, gzip, hashlib, lzma
+from pathlib import Path
+from typing import Generator, List, Optional, Set, Tuple
 from tqdm import tqdm
 
+from shards import SHARD_SUFFIX, IndexRow, ShardIndex, index_path, is_article_file, iso_date, load_articles, slices
+
+# on disk, single jsons and shards alike, large enough that restarting the compressor costs little
+BLOCK_BYTES = 1 << 20
+
+def compress_gz(data: bytes, level: int) -> bytes:
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def compress_xz(data: bytes, level: int) -> bytes:
+    return lzma.compress(data, preset=level)
+
+def compress_zst(data: bytes, level: int) -> bytes:
+    # zstandard is only needed for .zst destinations
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+# by destination suffix: (compress(data, level), default level), anything else is gzip
+CODECS = {".gz": (compress_gz, 9), ".xz": (compress_xz, 6), ".zst": (compress_zst, 9)}
+SHARD_NAME_RE = re.compile(rf"(train|val)-\d{{5}}-of-\d{{5}}{re.escape(SHARD_SUFFIX)}")
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# (sha1 of url, id, publish_date, site, sha1 of text, gzip member of the json line) of an exported article
+Exported = Tuple[str, Optional[str], str, str, str, bytes]
+
 def get_files(src: str) -> Generator[str, None, None]:
-    return (os.path.join(root, file) for root, _, files in os.walk(src) for file in files if file.endswith(".json"))
+    # sorted walk, the same tree always gives the same output
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        yield from (os.path.join(root, file) for file in sorted(files) if is_article_file(file))
 
 def load_txt(path: str) -> str:
-    with open(path, "rb") as f:
-        return json.load(f)["text"].strip() + "\n\n"
+    return "".join(data["text"].strip() + "\n\n" for data in load_articles(path))
+
+def codec(dest: str) -> str:
+    return next((suffix for suffix in CODECS if dest.endswith(suffix)), ".gz")
+
+def compress_block(args: Tuple[List[str], str, int]) -> Tuple[int, bytes]:
+    paths, suffix, level = args
+    compress, _ = CODECS[suffix]
+    return len(paths), compress("".join(load_txt(path) for path in paths).encode("utf8"), level)
 
-def process(src_root: str, dest: str) -> None:
-    files = get_files(src_root)
-    with gzip.open(dest, "wt", compresslevel=9) as o:
-        with mp.Pool(mp.cpu_count()) as p:
-            for data in tqdm(p.imap(load_txt, files)):
-                o.write(data)
+def process(src_root: str, dest: str, level: int = None) -> None:
+    suffix = codec(dest)
+    level = CODECS[suffix][1] if level is None else level
+    # missing zstandard or a bad level fails here, not in every worker
+    empty = CODECS[suffix][0](b"", level)
+    tasks = ((block, suffix, level) for block in slices(get_files(src_root), BLOCK_BYTES))
+    with open(dest, "wb") as o, mp.Pool(mp.cpu_count()) as p, tqdm(unit="file") as bar:
+        # imap keeps the order of the blocks while they are compressed in parallel
+        for n, data in p.imap(compress_block, tasks):
+            o.write(data)
+            bar.update(n)
+        # no input still has to be a valid (empty) compressed file
+        if o.tell() == 0: o.write(empty)
+
+def is_val(sha1: str, val: float) -> bool:
+    # by the url alone, an article stays in its split whatever else is selected
+    return int(sha1[:8], 16) < val * (1 << 32)
+
+def export_block(args: Tuple[List[str], str, Optional[Set[str]], str, str]) -> Tuple[int, List[Exported]]:
+    paths, src, sites, date_from, date_to = args
+    ret = []
+    for path in paths:
+        # site is the top level folder of parser.py output
+        site = os.path.relpath(path, src).split(os.sep)[0]
+        if sites is not None and site not in sites: continue
+        for data in load_articles(path):
+            text = data["text"].strip()
+            if not text or not date_from <= iso_date(data["publish_date"]) <= date_to: continue
+            line = json.dumps({**data, "site": site, "text": text}, ensure_ascii=False) + "\n"
+            ret.append((hashlib.sha1(data["url"].encode()).hexdigest(), data.get("id"), data["publish_date"], site,
+                        hashlib.sha1(text.encode("utf8")).hexdigest(), gzip.compress(line.encode("utf8"), mtime=0)))
+    return len(paths), ret
+
+def shard_names(split: str, n: int) -> List[str]:
+    # relative to the destination, the index stays valid wherever the export is moved
+    return [f"{split}-{i:05d}-of-{n:05d}{SHARD_SUFFIX}" for i in range(n)]
+
+def export(src_root: str, dest: Path, n_shards: int, val: float = 0.0, sites: Optional[Set[str]] = None,
+           date_from: str = "0000-00-00", date_to: str = "9999-99-99") -> Tuple[int, int, int]:
+    # exact duplicates (same url or same text) are dropped, the first in file order is kept, and the
+    # rest is dealt round robin to the shards of its split. returns (train, val, duplicates) articles
+    os.makedirs(dest, exist_ok=True)
+    # an earlier export may have had more shards, and they would be read with these
+    for name in os.listdir(dest):
+        if SHARD_NAME_RE.fullmatch(name): os.remove(dest / name)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(f"{index_path(dest)}{suffix}"): os.remove(f"{index_path(dest)}{suffix}")
+    splits = {"train": shard_names("train", n_shards)}
+    if val > 0: splits["val"] = shard_names("val", max(1, round(n_shards * val)))
+    files = {split: [open(dest / name, "wb") for name in names] for split, names in splits.items()}
+    written = {split: 0 for split in splits}
+    seen_urls, seen_texts, duplicates = set(), set(), 0
+    index = ShardIndex(dest)
+
+    tasks = ((block, src_root, sites, date_from, date_to) for block in slices(get_files(src_root), BLOCK_BYTES))
+    with mp.Pool(mp.cpu_count()) as p, tqdm(unit="file") as bar:
+        for n, articles in p.imap(export_block, tasks):
+            rows: List[IndexRow] = []
+            for sha1, id, publish_date, site, text_sha1, member in articles:
+                if sha1 in seen_urls or text_sha1 in seen_texts:
+                    duplicates += 1
+                    continue
+                seen_urls.add(sha1)
+                seen_texts.add(text_sha1)
+                split = "val" if val > 0 and is_val(sha1, val) else "train"
+                shard = written[split] % len(files[split])
+                f = files[split][shard]
+                rows.append((sha1, id, iso_date(publish_date), site, splits[split][shard], f.tell(), len(member)))
+                f.write(member)
+                written[split] += 1
+            index.add(rows)
+            bar.update(n)
+
+    for f in (f for split_files in files.values() for f in split_files): f.close()
+    index.close()
+    return written["train"], written.get("val", 0), duplicates
 
 if __name__ == "__main__":
-    _, src_root, dest_path = sys.argv
+    # ./txt_corpus.py <json-src-path> <txt-dest-path>[.gz|.xz|.zst] [level]
+    # ./txt_corpus.py <json-src-path> <shards-dest-path> --shards=N [--val=0.01] [--sites=hrt,jutarnji]
+    #                 [--from=2021-01-01] [--to=2021-12-31]
+    usage = ("./txt_corpus.py <json-src-path> <txt-dest-path> [level]\n"
+             "       ./txt_corpus.py <json-src-path> <shards-dest-path> --shards=N [--val=0.01] [--sites=hrt,jutarnji] "
+             "[--from=2021-01-01] [--to=2021-12-31]")
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    valid = 2 <= len(args) <= (2 if options else 3) and options.keys() <= {"shards", "val", "sites", "from", "to"}
+    if valid and options:
+        valid = (options.get("shards", "").isdigit() and int(options["shards"]) > 0
+                 and re.fullmatch(r"0|0?\.\d+", options.get("val", "0")) is not None
+                 and all(DATE_RE.fullmatch(options[key]) for key in ("from", "to") if key in options)
+                 and options.get("sites") != "")
+    if valid and len(args) > 2: valid = args[2].isdigit()
+    if not valid: sys.exit(f"usage: {usage}")
+    src_root, dest_path = args[:2]
     print(f"processing from {src_root}")
-    process(src_root, dest_path)
-
+    if options:
+        sites = set(options["sites"].split(",")) if "sites" in options else None
+        train, val, duplicates = export(src_root, Path(dest_path), int(options["shards"]), float(options.get("val", 0)),
+                                        sites, options.get("from", "0000-00-00"), options.get("to", "9999-99-99"))
+        print(f"{train} train and {val} val articles written to {dest_path}, {duplicates} duplicates skipped, "
+              f"index in {index_path(Path(dest_path))}")
+    else:
+        process(src_root, dest_path, int(args[2]) if len(args) > 2 else None)
@@ -0,0 +1,89 @@
+# persistent word counts of wordy.py: the counts each parsed file (or shard) contributed and
+# the global totals, so a rerun only recounts new and changed files and subtracts deleted ones
+import sqlite3, zlib
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+# (path, size, mtime_ns, words counted in it)
+Contribution = Tuple[str, int, int, Counter]
+
+
+def store_path(dest: Path) -> Path:
+    return dest / "word_counts.db"
+
+
+def encode(words: Counter) -> Tuple[bytes, bytes]:
+    vocab = zlib.compress("\n".join(words).encode("utf8"))
+    counts = zlib.compress(np.fromiter(words.values(), dtype=np.int64, count=len(words)).tobytes())
+    return vocab, counts
+
+
+def decode(vocab: bytes, counts: bytes) -> Counter:
+    counts = np.frombuffer(zlib.decompress(counts), dtype=np.int64)
+    if len(counts) == 0: return Counter()
+    return Counter(dict(zip(zlib.decompress(vocab).decode("utf8").split("\n"), counts.tolist())))
+
+
+class WordStore:
+    def __init__(self, path: Path) -> None:
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                vocab BLOB,
+                counts BLOB
+            );
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS words (
+                word TEXT PRIMARY KEY,
+                frequency INTEGER
+            );
+        """)
+
+    def seen(self) -> Dict[str, Tuple[int, int]]:
+        cursor = self.conn.execute("SELECT path, size, mtime_ns FROM files;")
+        return {path: (size, mtime_ns) for path, size, mtime_ns in cursor}
+
+    def _contribution(self, path: str) -> Counter:
+        row = self.conn.execute("SELECT vocab, counts FROM files WHERE path = ?;", (path,)).fetchone()
+        return Counter() if row is None else decode(*row)
+
+    def _apply(self, delta: Counter) -> None:
+        self.conn.executemany("""
+            INSERT INTO words VALUES (?, ?)
+            ON CONFLICT (word) DO UPDATE SET frequency = frequency + excluded.frequency;
+        """, ((word, count) for word, count in delta.items() if count != 0))
+        self.conn.execute("DELETE FROM words WHERE frequency <= 0;")
+
+    def update(self, contributions: List[Contribution]) -> None:
+        # replaces what the files contributed before, one transaction per batch
+        delta = Counter()
+        with self.conn:
+            for path, size, mtime_ns, words in contributions:
+                delta.subtract(self._contribution(path))
+                delta.update(words)
+                self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?);",
+                                  (path, size, mtime_ns, *encode(words)))
+            self._apply(delta)
+
+    def remove(self, paths: Iterable[str]) -> None:
+        delta = Counter()
+        with self.conn:
+            for path in paths:
+                delta.subtract(self._contribution(path))
+                self.conn.execute("DELETE FROM files WHERE path = ?;", (path,))
+            self._apply(delta)
+
+    def rows(self) -> Iterator[Tuple[str, int]]:
+        return self.conn.execute("SELECT word, frequency FROM words;")
+
+    def close(self) -> None:
+        self.conn.close()
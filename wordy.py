@@ -1,15 +1,21 @@
 #!./venv/bin/python
-import multiprocessing as mp, sys, os, csv, json
+import multiprocessing as mp, sys, os, csv, re
 
-from typing import Generator
-from collections import Counter
+from typing import Generator, Iterable, List, Optional, Tuple
+from collections import Counter, defaultdict
+from itertools import chain
+from pathlib import Path
 
 import regex
-import nltk
-nltk.download('punkt')
+import numpy as np
 
 from tqdm import tqdm
-from nltk.tokenize import sent_tokenize
+
+from resources import sent_tokenize, sentence_tokenizer
+from shards import is_article_file, load_articles, slices
+from word_store import WordStore, store_path
+from counting import HeavyHitters, SpillCounter, word_hashes
+from facets import FacetCounts, FacetPartial, facet_name, to_facet_partial
 
 RE_URL = regex.compile(r"^(?:http(s)?:\/\/)?[\w.-]+(?:\.[\w\.-]+)+[\w\-\._~:/?#[\]@!\$&'\(\)\*\+,;=.]+$", regex.IGNORECASE)
 def is_url(word: str) -> bool:
@@ -23,67 +29,229 @@ def is_email(word: str) -> bool:
         return RE_EMAIL.match(word, timeout=1) is not None
     except Exception:
         return False
-TRANSLATE = str.maketrans('', '', ''',.?;:'"!()+=/»’“''')
+TRANSLATE_CHARS = ''',.?;:'"!()+=/»’“'''
+TRANSLATE = str.maketrans('', '', TRANSLATE_CHARS)
 VALID_CHARS = set('''qwertyuiopasdfghjklzxcvbnmčćđšž,.?;:'"!()-+=/''')
+# VALID_CHARS left after TRANSLATE, i.e. letters and -
+RE_VALID = re.compile("[%s]+" % re.escape("".join(sorted(VALID_CHARS - set(TRANSLATE_CHARS)))))
+# bytes of article files on disk counted by one worker before it sends anything back, cut by size
+# since a slice may be a few thousand single jsons or a couple of shards, partials merged per merge task
+SLICE_BYTES = 8 << 20
+MERGE_FANIN = 8
+# files whose counts are written to the word store per transaction
+STORE_BATCH = 1000
+# default for distinct words held in memory by --spill and --sketch (--max-words=N, at least 2), the
+# sketch itself is another SKETCH_DEPTH x SKETCH_WIDTH uint32 counters (128MB)
+MAX_WORDS = 5_000_000
+SKETCH_WIDTH = 1 << 23
+SKETCH_DEPTH = 4
+
+# counts of one slice of files: the words joined by \n (valid words never contain one)
+# and their counts in the same order, a lot cheaper to pickle than a Counter
+Partial = Tuple[str, np.ndarray]
 
 
 def get_files(src: str) -> Generator[str, None, None]:
-    return (os.path.join(root, file) for root, _, files in os.walk(src) for file in files)
+    return (os.path.join(root, file) for root, _, files in os.walk(src) for file in files if is_article_file(file))
 
 def process(file_path: str):
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    # a parsed json or a whole shard of them
+    words = Counter()
+    for data in load_articles(file_path):
+        words.update(count_words(data["text"]))
+    return words
 
-    # split to sentences
-    sentences = sent_tokenize(data["text"])
+def to_partial(words: Counter) -> Partial:
+    return "\n".join(words), np.fromiter(words.values(), dtype=np.int64, count=len(words))
 
-    # split by space
-    words = (w for s in sentences for w in s.split(" "))
+def from_partial(partial: Partial) -> Counter:
+    vocab, counts = partial
+    return Counter(dict(zip(vocab.split("\n"), counts.tolist()))) if len(counts) else Counter()
 
-    # filter out urls
-    words = filter(lambda word: not is_url(word), words)
+def count_slice(files: List[str]) -> Partial:
+    words = Counter()
+    for file_path in files:
+        words.update(process(file_path))
+    return to_partial(words)
 
-    # filter out emails
-    words = filter(lambda word: not is_email(word), words)
+def merge(partials: List[Partial]) -> Partial:
+    words = Counter()
+    for partial in partials:
+        words.update(from_partial(partial))
+    return to_partial(words)
 
-    # filter out capitalized words
-    words = filter(lambda word: not word.istitle(), words)
+def count_files(p: mp.Pool, files: Iterable[str]) -> Counter:
+    # workers count whole slices and merge each other's partials, MERGE_FANIN at a time,
+    # the parent only hands out work and does the last small merge
+    pending: List[Partial] = []
+    merging = []
+    for partial in tqdm(p.imap_unordered(count_slice, slices(files, SLICE_BYTES)), unit="slice"):
+        pending.append(partial)
+        ready = [m for m in merging if m.ready()]
+        merging = [m for m in merging if m not in ready]
+        pending.extend(m.get() for m in ready)
+        if len(pending) >= MERGE_FANIN:
+            merging.append(p.apply_async(merge, (pending,)))
+            pending = []
+    pending.extend(m.get() for m in merging)
+    while len(pending) > MERGE_FANIN:
+        pending = p.map(merge, [pending[i:i + MERGE_FANIN] for i in range(0, len(pending), MERGE_FANIN)])
+    return from_partial(merge(pending))
 
-    # replace - from front and back if exists
-    words = map(lambda word: word.strip("-"), words)
+def hash_slice(files: List[str]) -> Tuple[Partial, np.ndarray]:
+    partial = count_slice(files)
+    return partial, word_hashes(partial[0].split("\n") if len(partial[1]) else [])
 
-    # filter double or more '-'
-    words = filter(lambda word: Counter(word)["-"] <= 1, words)
+def count_files_spilled(p: mp.Pool, files: Iterable[str], tmp_dir: str, max_words: int = MAX_WORDS) -> SpillCounter:
+    # exact, counts above max_words distinct words go to sorted runs on disk
+    words = SpillCounter(max_words, tmp_dir)
+    for partial in tqdm(p.imap_unordered(count_slice, slices(files, SLICE_BYTES)), unit="slice"):
+        words.update(from_partial(partial))
+    print(f"merging {len(words.runs) + 1} runs")
+    return words
 
-    # replace all symbols
-    words = map(lambda word: word.translate(TRANSLATE), words)
+def count_files_sketched(p: mp.Pool, files: Iterable[str], max_words: int = MAX_WORDS) -> HeavyHitters:
+    # approximate, counts can be too high, never too low, and rare words are left out
+    words = HeavyHitters(max_words, SKETCH_WIDTH, SKETCH_DEPTH)
+    for (vocab, counts), hashes in tqdm(p.imap_unordered(hash_slice, slices(files, SLICE_BYTES)), unit="slice"):
+        if len(counts): words.update(vocab.split("\n"), counts, hashes)
+    return words
 
-    # to lowercase
-    words = map(lambda word: word.lower(), words)
+def count_facets_slice(args: Tuple[List[str], str, bool]) -> Tuple[FacetPartial, Optional[FacetPartial]]:
+    # words (and bigrams of words next to each other in a sentence, see tokenize) per site and month
+    files, src, bigrams = args
+    words, pairs = defaultdict(Counter), defaultdict(Counter)
+    for file_path in files:
+        # site is the top level folder of parser.py output
+        site = os.path.relpath(file_path, src).split(os.sep)[0]
+        for data in load_articles(file_path):
+            facet = facet_name(site, data["publish_date"])
+            runs = tokenize(data["text"])
+            words[facet].update(chain.from_iterable(runs))
+            if bigrams: pairs[facet].update(word_pairs(runs))
+    return to_facet_partial(words), to_facet_partial(pairs) if bigrams else None
 
-    # take only if word has valid chars
-    words = filter(lambda word: len(set(word) - VALID_CHARS) == 0, words)
+def count_files_faceted(p: mp.Pool, files: Iterable[str], src: str, bigrams: bool) -> Tuple[FacetCounts, FacetCounts]:
+    words, pairs = FacetCounts(), FacetCounts()
+    tasks = ((files_slice, src, bigrams) for files_slice in slices(files, SLICE_BYTES))
+    for word_partial, pair_partial in tqdm(p.imap_unordered(count_facets_slice, tasks), unit="slice"):
+        words.add(word_partial)
+        if pair_partial is not None: pairs.add(pair_partial)
+    return words, pairs
 
-    # filter out empty words
-    words = filter(lambda word: word, words)
+def count_file(args: Tuple[str, str, int, int]) -> Tuple[str, int, int, Partial]:
+    file_path, key, size, mtime_ns = args
+    return key, size, mtime_ns, to_partial(process(file_path))
 
-    return Counter(words)
+def update_store(p: mp.Pool, store: WordStore, src: str) -> None:
+    # files are keyed relative to src, only new and changed ones are counted again
+    seen = store.seen()
+    changed = []
+    for file_path in get_files(src):
+        stat = os.stat(file_path)
+        key = os.path.relpath(file_path, src)
+        if seen.pop(key, None) != (stat.st_size, stat.st_mtime_ns):
+            changed.append((file_path, key, stat.st_size, stat.st_mtime_ns))
+    print(f"{len(changed)} new or changed files, {len(seen)} removed")
+    store.remove(seen)
 
+    batch = []
+    for key, size, mtime_ns, partial in tqdm(p.imap_unordered(count_file, changed, chunksize=64), total=len(changed)):
+        batch.append((key, size, mtime_ns, from_partial(partial)))
+        if len(batch) >= STORE_BATCH:
+            store.update(batch)
+            batch = []
+    store.update(batch)
+
+def tokenize(text: str) -> List[List[str]]:
+    # one pass over the tokens with the same words as the old filter/map chain (kept in
+    # wordy_bench.py): url and email regexes only run on tokens that could match them,
+    # the valid char check is a single regex instead of a set per word. words come in runs,
+    # a dropped token ends the run, so words either side of it are never taken as neighbours
+    ret = []
+    for sentence in sent_tokenize(text):
+        words = []
+        for word in sentence.split(" "):
+            # repeated spaces, not a token
+            if not word: continue
+            if ("." in word and is_url(word) or "@" in word and is_email(word) or word.istitle()
+                    or word.strip("-").count("-") > 1):
+                word = ""
+            word = word.strip("-").translate(TRANSLATE).lower()
+            # also drops words left empty
+            if RE_VALID.fullmatch(word):
+                words.append(word)
+            elif words:
+                ret.append(words)
+                words = []
+        if words: ret.append(words)
+    return ret
+
+def word_pairs(runs: List[List[str]]) -> Generator[str, None, None]:
+    # bigrams of tokenize output, only within a run
+    return (f"{a} {b}" for run in runs for a, b in zip(run, run[1:]))
+
+def count_words(text: str):
+    return Counter(chain.from_iterable(tokenize(text)))
 
 if __name__ == "__main__":
-    _, src_root, dest_path = sys.argv
+    # --incremental keeps per file counts in <dest-path>/word_counts.db and only recounts
+    # files added or changed since the last run, word_list.csv is written from the store,
+    # --spill and --sketch cap memory, exact with sorted runs on disk or approximate,
+    # --facets also writes counts per site and month (--bigrams adds bigram counts) as npz
+    usage = ("./wordy.py <src-path> <dest-path> "
+             "[--incremental | --spill [--max-words=N] | --sketch [--max-words=N] | --facets [--bigrams]]")
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    incremental = "incremental" in options
+    spill = "spill" in options
+    sketch = "sketch" in options
+    faceted = "facets" in options
+    bigrams = "bigrams" in options
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    # one counting mode per run, the others would be silently ignored
+    if (len(args) != 2 or incremental + spill + sketch + faceted > 1 or bigrams and not faceted
+            or "max-words" in options and not ((spill or sketch) and options["max-words"].isdigit()
+                                               and int(options["max-words"]) >= 2)
+            or not options.keys() <= {"incremental", "spill", "sketch", "facets", "bigrams", "max-words"}):
+        sys.exit(f"usage: {usage}")
+    max_words = int(options.get("max-words", MAX_WORDS))
+    src_root, dest_path = args
     print(f"processing from {src_root}")
-    files = get_files(src_root)
 
     print("start processing")
-    words = Counter()
+    # loaded before the pool forks, workers share it
+    sentence_tokenizer()
     with mp.Pool(mp.cpu_count()) as p:
-        for ws in tqdm(p.imap(process, files)):
-            words.update(ws)
+        if incremental:
+            store = WordStore(store_path(Path(dest_path)))
+            update_store(p, store, src_root)
+            words = list(store.rows())
+            store.close()
+        elif spill:
+            counter = count_files_spilled(p, get_files(src_root), dest_path, max_words)
+        elif sketch:
+            words = count_files_sketched(p, get_files(src_root), max_words).items()
+        elif faceted:
+            word_facets, bigram_facets = count_files_faceted(p, get_files(src_root), src_root, bigrams)
+            matrix = word_facets.save(f"{dest_path}/word_facets.npz")
+            print(f"{matrix.shape[0]} words x {matrix.shape[1]} facets written to {dest_path}/word_facets.npz")
+            if bigrams:
+                matrix = bigram_facets.save(f"{dest_path}/bigram_facets.npz")
+                print(f"{matrix.shape[0]} bigrams x {matrix.shape[1]} facets written to {dest_path}/bigram_facets.npz")
+            # word_list.csv is the sum over all facets
+            words = list(zip(word_facets.vocab, word_facets.matrix().sum(axis=1).A1.tolist()))
+        else:
+            words = list(count_files(p, get_files(src_root)).items())
 
-    print(f"writing csv file into {dest_path} with {len(words)} rows")
+    if spill:
+        # merged while writing, never all in memory
+        print(f"writing csv file into {dest_path}")
+        words = counter.items()
+    else:
+        print(f"writing csv file into {dest_path} with {len(words)} rows")
     with open(f"{dest_path}/word_list.csv", "w", encoding="utf8") as f:
         writer = csv.writer(f, delimiter=",")
         writer.writerow(["word", "frequency"])
-        writer.writerows(words.items())
+        writer.writerows(words)
+    if spill: counter.close()
 
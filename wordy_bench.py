@@ -0,0 +1,84 @@
+#!./venv/bin/python
+# compares wordy.count_words with the filter/map chain it replaced on a sample of parsed
+# articles (or the golden texts in fixtures/), checks the counts are identical and reports
+# words/s of both. also checks the bigrams of wordy.tokenize never join words across a dropped token
+import sys, json, random, time
+
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+from resources import sent_tokenize
+from shards import load_articles
+from wordy import TRANSLATE, VALID_CHARS, count_words, get_files, is_email, is_url, tokenize, word_pairs
+
+FIXTURES = Path(__file__).parent / "fixtures"
+# sentence -> its bigrams, names, urls, emails and invalid words end a run
+PAIR_CASES = {
+    "danas je Ivan rekao da www.primjer.hr nije radio": ["danas je", "rekao da", "nije radio"],
+    "pišite na info@primjer.hr ili  nazovite prije podne": ["pišite na", "ili nazovite", "nazovite prije", "prije podne"],
+    "cijena je 100 kuna po komadu": ["cijena je", "kuna po", "po komadu"],
+}
+
+
+def count_words_chain(text: str):
+    # wordy.count_words before it was fused into one loop, the reference for identical output
+    sentences = sent_tokenize(text)
+    words = (w for s in sentences for w in s.split(" "))
+    words = filter(lambda word: not is_url(word), words)
+    words = filter(lambda word: not is_email(word), words)
+    words = filter(lambda word: not word.istitle(), words)
+    words = map(lambda word: word.strip("-"), words)
+    words = filter(lambda word: Counter(word)["-"] <= 1, words)
+    words = map(lambda word: word.translate(TRANSLATE), words)
+    words = map(lambda word: word.lower(), words)
+    words = filter(lambda word: len(set(word) - VALID_CHARS) == 0, words)
+    words = filter(lambda word: word, words)
+    return Counter(words)
+
+
+def sample_texts(src: str, sample_size: int) -> List[str]:
+    files = sorted(get_files(src))
+    random.Random(0).shuffle(files)
+    texts = []
+    for file in files:
+        texts.extend(data["text"] for data in load_articles(file))
+        if len(texts) >= sample_size: break
+    return texts[:sample_size]
+
+
+def bench(fn, texts: List[str], iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        words = Counter()
+        for text in texts: words.update(fn(text))
+    return words, (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    # ./wordy_bench.py [parsed-path sample-size] [iterations]
+    args = sys.argv[1:]
+    if len(args) >= 2:
+        texts = sample_texts(args[0], int(args[1]))
+        iterations = int(args[2]) if len(args) > 2 else 1
+    else:
+        texts = [json.loads(p.read_text(encoding="utf8"))["text"] for p in sorted(FIXTURES.glob("*.golden.json"))]
+        iterations = int(args[0]) if args else 200
+
+    for sentence, expected in PAIR_CASES.items():
+        found = list(word_pairs(tokenize(sentence)))
+        if found != expected: sys.exit(f"bigrams of {sentence!r}: {found} != {expected}")
+    print(f"bigrams of {len(PAIR_CASES)} sentences stay within runs")
+
+    tokens = sum(len(s.split(" ")) for text in texts for s in sent_tokenize(text))
+    print(f"{len(texts)} texts, {tokens} tokens, {iterations} iterations")
+    reference, chain_took = bench(count_words_chain, texts, iterations)
+    fused, fused_took = bench(count_words, texts, iterations)
+    print(f"chain {tokens / chain_took:12.0f} tokens/s")
+    print(f"fused {tokens / fused_took:12.0f} tokens/s  {chain_took / fused_took:.2f}x")
+
+    if fused != reference:
+        for word in sorted(set(fused) | set(reference)):
+            if fused[word] != reference[word]: print(f"    {word!r}: chain {reference[word]} fused {fused[word]}")
+        sys.exit(1)
+    print(f"identical counts for {len(reference)} words")